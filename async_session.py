@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   async_session.py
+# @Time    :   2025/08/22 14:05:51
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import asyncio
+import random
+import re
+import time
+from datetime import datetime
+from urllib import parse
+
+import httpx
+import pyotp
+from loguru import logger
+
+import codes
+import hedge
+import limiter
+import metrics
+import prewarm
+import session_cache
+from retry import SimsoError
+from session import BaseSession, default_headers
+
+# 单个请求的超时秒数
+DEFAULT_TIMEOUT = 10
+
+
+class AsyncSession(BaseSession):
+    """基于 httpx.AsyncClient 的异步会话，接口与 Session 一致，方法均为协程
+
+    需在同一个事件循环中使用，推荐 `async with AsyncSession(...) as s:`。
+    """
+
+    def __init__(self, config, notifier=None, **client_kwargs) -> None:
+        self._setup(config, notifier)
+        self._status_lock = asyncio.Lock()
+        # 与 requests.Session.params 相同，合并到每个请求的查询参数中
+        self.params = {}
+        client_kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        # 每个同时在途的被预约人保留一个连接，空闲超时长于保活间隔
+        client_kwargs.setdefault(
+            "limits",
+            httpx.Limits(
+                max_keepalive_connections=self._pool_size() + len(prewarm.HOSTS),
+                keepalive_expiry=prewarm.KEEPALIVE_INTERVAL * 2,
+            ),
+        )
+        # HTTP/2 经 ALPN 协商，服务端不支持时 httpx 自动使用 HTTP/1.1
+        http2 = self._config.get("http2", False)
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2（pip install 'httpx[http2]'），使用 HTTP/1.1")
+                http2 = False
+        # 到 simso 的连接是否已协商为 HTTP/2，是则所有请求复用一条连接
+        self._multiplexed = False
+        self._client = httpx.AsyncClient(
+            headers=default_headers(self._config["username"]),
+            follow_redirects=True,
+            http2=http2,
+            **client_kwargs,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        keeper = getattr(self, "_keeper", None)
+        if keeper:
+            keeper.cancel()
+        await self._client.aclose()
+
+    @property
+    def cookies(self):
+        return self._client.cookies
+
+    @property
+    def _cookie_jar(self):
+        return self._client.cookies.jar
+
+    async def _request(self, method, url, params=None, **kwargs):
+        params = {**self.params, **(params or {})}
+        async with limiter.slot_async(url):
+            t_send = time.time()
+            with self._timer(url):
+                res = await self._client.request(
+                    method, self._rewrite(url), params=params, **kwargs
+                )
+        res.t_send, res.t_recv = t_send, time.time()
+        self._check_status_code(res)
+        return res
+
+    def prepare(self):
+        """预热阶段构造开放时刻的 checkSqrq / saveSqxx 请求，接口说明见 Session.prepare"""
+        # 按当前配置展开被预约人，开放时刻直接复用
+        self._visitor_list = None
+        self._visitor_list = self._visitors()
+        prepared = {}
+        for key, (method, url, params, body) in self._prepare_targets().items():
+            prepared[key] = (
+                url,
+                self._client.build_request(
+                    method, self._rewrite(url), params={**self.params, **params}, json=body
+                ),
+            )
+        self._prepared, self._prepared_sid = prepared, self.params["sid"]
+
+    async def _send_prepared(self, entry):
+        """发送预先构造的请求，验证状态码"""
+        url, request = entry
+        async with limiter.slot_async(url):
+            t_send = time.time()
+            with self._timer(url):
+                res = await self._client.send(request)
+        res.t_send, res.t_recv = t_send, time.time()
+        self._check_status_code(res)
+        return res
+
+    async def _hedged(self, phase, call, on_extra=None):
+        """开启 hedge 时对冲发送 call，否则直接调用"""
+        if not self._hedging():
+            return await call()
+        return await hedge.run_async(phase, call, on_extra)
+
+    async def get(self, url, **kwargs):
+        """验证状态码的 get 请求"""
+        return await self._request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        """验证状态码的 post 请求"""
+        return await self._request("POST", url, **kwargs)
+
+    async def _ping(self, count=1, url=prewarm.KEEPALIVE_URL):
+        """同时发出 count 个 HEAD 请求，建立或保活 count 个连接"""
+
+        async def head():
+            try:
+                res = await self._client.head(self._rewrite(url))
+                if url == prewarm.KEEPALIVE_URL:
+                    self._multiplexed = res.http_version == "HTTP/2"
+            except httpx.HTTPError as e:
+                logger.debug(f"保活请求失败: {e}")
+
+        await asyncio.gather(*(head() for _ in range(count)))
+
+    async def warm_connections(self):
+        """预先建立到各主机的 TCP + TLS 连接（DNS 由 httpx 自行解析，不做固定）"""
+        await self._ping(1, "https://iaaa.pku.edu.cn/")
+        await self._ping(1, "https://portal.pku.edu.cn/")
+        # 先建立一条连接，协商为 HTTP/2 时不再建立更多连接
+        await self._ping(1)
+        if not self._multiplexed and self._pool_size() > 1:
+            await self._ping(self._pool_size())
+
+    async def keep_warm(self, until):
+        """在本地时刻 until 之前，定期保活连接池中到 simso 的全部连接"""
+        while True:
+            remaining = (until - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(prewarm.KEEPALIVE_INTERVAL, remaining))
+            if datetime.now() >= until:
+                return
+            await self._ping(1 if self._multiplexed else self._pool_size())
+
+    def start_keep_warm(self, until):
+        """在当前事件循环中保活连接直到 until"""
+        # 保存引用，避免任务被回收
+        self._keeper = asyncio.create_task(self.keep_warm(until))
+
+    async def login(self) -> bool:
+        """登录门户，重定向出入校申请"""
+        # IAAA 登录
+        json = (
+            await self.post(
+                "https://iaaa.pku.edu.cn/iaaa/oauthlogin.do",
+                data={
+                    "userName": self._config["username"],
+                    "appid": "portal2017",
+                    "password": self._config["password"],
+                    "redirUrl": "https://portal.pku.edu.cn/portal2017/ssoLogin.do",
+                    "randCode": "",
+                    "smsCode": "",
+                    "optCode": "",
+                },
+            )
+        ).json()
+        assert json["success"], json
+
+        # 门户 token 验证
+        await self.get(
+            "https://portal.pku.edu.cn/portal2017/ssoLogin.do",
+            params={"_rand": random.random(), "token": json["token"]},
+        )
+
+        # 学生出入校重定向
+        res = await self.get(
+            "https://portal.pku.edu.cn/portal2017/util/appSysRedir.do?appId=simso-biz&p1=sadEpiVisitorAppt"
+        )
+        redir = parse.parse_qs(parse.urlparse(str(res.url)).query)
+        token = redir["token"][0]
+
+        # 登录学生出入校
+        json = (
+            await self.get(
+                "https://simso.pku.edu.cn/ssapi/simsoLogin", params={"token": token}
+            )
+        ).json()
+        assert json["success"], json
+        sid = json["sid"]
+
+        # 设置请求参数
+        self.params["sid"] = sid
+        self.params["_sk"] = self._config["username"]
+        self.cookies.set("sid", sid, domain="simso.pku.edu.cn")
+        self.sid_issued_at = time.time()
+
+        # 获取出入校申请时段信息
+        return await self.login_check()
+
+    async def restore(self) -> bool:
+        """从会话缓存恢复 sid 与 cookies，并用 login_check 验证是否仍然有效"""
+        student_id = self._config["username"]
+        state = await asyncio.to_thread(
+            session_cache.load, student_id, self._config["password"]
+        )
+        if not state:
+            return False
+
+        self._import_state(state)
+        try:
+            if await self.login_check():
+                logger.info(f"学生 {student_id} 复用缓存的会话")
+                return True
+        except Exception as e:
+            logger.debug(f"学生 {student_id} 缓存的会话验证失败: {e}")
+
+        self._forget_state()
+        session_cache.clear(student_id)
+        return False
+
+    async def ensure_login(self, force=False) -> bool:
+        """优先复用缓存的会话，失效（或 force）时才走完整的 IAAA 登录流程"""
+        if not force and self._use_cache() and await self.restore():
+            return True
+        if not await self.login():
+            return False
+        if self._use_cache():
+            await asyncio.to_thread(
+                session_cache.save,
+                self._config["username"],
+                self._config["password"],
+                self._export_state(),
+            )
+        return True
+
+    async def login_check(self):
+        """检查是否已登录"""
+        json = self._parse(
+            await self.get(
+                "https://simso.pku.edu.cn/ssapi/stuaffair/epiApply/getJrsqxx"
+            )
+        )
+        valid = json["success"] and json["row"]["sfyxsq"] == "y"
+        if not valid:
+            self.invalidate_sid()
+        return valid
+
+    async def sync_clock(self, samples=5, interval=0.2):
+        """多次调用 login_check 采样服务器时钟，返回 (offset, uncertainty)"""
+        for i in range(samples):
+            if i:
+                await asyncio.sleep(interval)
+            await self.login_check()
+        return self._log_clock()
+
+    async def status(self, appointment):
+        """获取申请状态（当前是否可申请），接口说明见 Session.status"""
+        # TTL 内已确认 sid 有效时跳过 getJrsqxx，减少开放时刻的请求
+        if not self.sid_valid() and not await self.login_check():
+            raise Exception("You should login first to use this method")
+
+        key = (appointment["mode"], appointment["yyrq"])
+        # 并发提交时只让第一个请求检查日期，其余复用其结果
+        async with self._status_lock:
+            if key in self._status_cache:
+                return self._status_cache[key]
+
+            prepared = self._prepared_for("checkSqrq", *key)
+            if prepared:
+                res = await self._send_prepared(prepared)
+            else:
+                res = await self.get(
+                    self._url(appointment, "checkSqrq"),
+                    params={"sqrq": appointment["yyrq"]},
+                )
+            json = self._parse(res)
+            self._assert_success(json)
+            self._status_cache[key] = json
+            return json
+
+    async def save_request(self, appointment, visitor):
+        """尝试保存出入校信息，返回 sqxxid"""
+        # 检查是否可申请
+        await self.status(appointment)
+
+        prepared = self._prepared_for("saveSqxx", self._visitor_key(appointment, visitor))
+
+        async def send():
+            if prepared:
+                return self._parse(await self._send_prepared(prepared))
+            return self._parse(
+                await self.post(
+                    self._url(appointment, "saveSqxx"),
+                    json=self._build_template(appointment, visitor),
+                )
+            )
+
+        res = await self._hedged("saveSqxx", send, self._reconcile(appointment, visitor))
+        self._assert_success(res)
+
+        return res["row"]
+
+    async def request_2fa_code(self, appointment, sqxxid):
+        """请求发送短信验证码"""
+        res = self._parse(
+            await self.get(
+                self._url(appointment, "sendEcyzCode"),
+                params={"sqxxid": sqxxid},
+            )
+        )
+        self._assert_success(res)
+
+    async def get_2fa_code(self, appointment, sqxxid):
+        """获取 sqxxid 对应的 2FA 验证码"""
+        student_id = self._config["username"]
+
+        # 基于 secret 的 totp 获取
+        if self._config["auto"] and self._config["totp_mode"] == "secret":
+            totp = pyotp.TOTP(self._config["totp_secret"])
+            return totp.now()
+
+        if self._config["auto"] and not codes.broker.attached:
+            codes.listen(student_id)
+
+        # 学号锁可能被其它线程中的会话持有，在事件循环中等待其释放
+        # 流水线：登记等待者后发送验证码即释放锁，验证码按到达顺序分配
+        if self._pipelined():
+            with metrics.registry.timer("code_lock"):
+                await self._code_lock.acquire_async()
+            try:
+                # 登记与发送在同一把锁内完成，保证登记顺序与短信发送顺序一致
+                ticket = codes.expect(student_id)
+                try:
+                    await self.request_2fa_code(appointment, sqxxid)
+                except Exception:
+                    codes.cancel(student_id, ticket)
+                    raise
+            finally:
+                self._code_lock.release()
+
+            with metrics.registry.timer("code_wait"):
+                return await codes.wait_for_ticket_async(student_id, ticket)
+
+        # 基于捷径的 totp 获取，同一学号的验证码文件只能串行使用
+        with metrics.registry.timer("code_lock"):
+            await self._code_lock.acquire_async()
+        try:
+            # 清空学号特定的验证码文件与推送队列中的旧验证码
+            codes.reset(student_id)
+            await self.request_2fa_code(appointment, sqxxid)
+
+            with metrics.registry.timer("code_wait"):
+                # 手动输入 2FA code
+                if not self._config["auto"]:
+                    return await asyncio.to_thread(
+                        input, f"Please input the 2FA code for {student_id}: "
+                    )
+
+                # 自动获取 2FA code
+                return await asyncio.to_thread(codes.wait_for_code, student_id)
+        finally:
+            self._code_lock.release()
+
+    async def submit_request(self, appointment, visitor):
+        key = self._visitor_key(appointment, visitor)
+        name = self._label(appointment, visitor)
+        try:
+            with metrics.labels(
+                student=self._config["username"], date=appointment["yyrq"], visitor=name
+            ), metrics.registry.timer("visitor_total"):
+                await self._submit_request(appointment, visitor, key, name)
+        except Exception as e:
+            if self.journal:
+                await asyncio.to_thread(
+                    self.journal.finished, key, name, False, str(e)
+                )
+            raise
+        if self.journal:
+            await asyncio.to_thread(self.journal.finished, key, name, True)
+
+    async def _submit_request(self, appointment, visitor, key, name):
+        # 崩溃前已保存但未提交的申请直接复用 sqxxid
+        sqxxid = (
+            await asyncio.to_thread(self.journal.sqxxid, key) if self.journal else None
+        )
+        if sqxxid:
+            logger.info(f"复用 {name} 此前保存的申请 {sqxxid}")
+        else:
+            async with self._slot():
+                if self.retry:
+                    sqxxid = await self.retry.acall(
+                        "saveSqxx",
+                        self.save_request,
+                        appointment,
+                        visitor,
+                        on_ambiguous=self._reconcile_retry(appointment, visitor),
+                    )
+                else:
+                    sqxxid = await self.save_request(appointment, visitor)
+        if self.journal:
+            await asyncio.to_thread(self.journal.saved, key, name, sqxxid)
+        code = await self.get_2fa_code(appointment, sqxxid)
+
+        code = re.search(r"\d{6}", code).group()
+        assert code, f"{'[Error]':<15}: Invalid 2FA code"
+
+        tried = set()
+        while True:
+            tried.add(code)
+            try:
+                self._assert_success(await self._submit_code(appointment, sqxxid, code))
+                break
+            except SimsoError as e:
+                if not self._code_rejected(e):
+                    raise
+                # 流水线下验证码按到达顺序分配，前面的短信迟到或丢失时会错位，改用其它验证码
+                code = await codes.wait_for_other_async(self._config["username"], tried)
+                logger.warning(f"{name} 的验证码被判错误，改用验证码 {code} 重试")
+        if self._pipelined():
+            codes.confirm(self._config["username"], code)
+        logger.success(f"Succeed: {name}")
+        if self._notifier:
+            self._notifier.send(f"Succeed: {name}")
+
+    async def _submit_code(self, appointment, sqxxid, code):
+        async def send():
+            return self._parse(
+                await self.get(
+                    self._url(appointment, "submitSqxx"),
+                    params={"sqxxid": sqxxid, "code": code},
+                )
+            )
+
+        # 对冲提交使用同一个 sqxxid 与验证码，服务端只会受理一次
+        async with self._slot():
+            return await self._hedged("submitSqxx", send)
+
+    async def submit_all(self):
+        """提交所有申请，返回每位被预约人的结果"""
+        results, visitors = self._split_succeeded(self._visitors())
+        self._reset_status()
+
+        concurrency = self._config.get("concurrency", 1)
+        # 流水线：等待验证码不占名额，保存与提交最多 concurrency 个同时进行
+        if self._pipelined() and len(visitors) > 1:
+            return results + await self._submit_concurrently(
+                visitors, len(visitors), slots=concurrency
+            )
+        if concurrency > 1 and len(visitors) > 1:
+            return results + await self._submit_concurrently(visitors, concurrency)
+
+        # 串行提交，任一失败即抛出异常
+        for appointment, visitor in visitors:
+            await self.submit_request(appointment, visitor)
+            results.append((self._label(appointment, visitor), True, "success"))
+        return results
+
+    async def _submit_concurrently(self, visitors, concurrency, slots=None):
+        """在同一个 sid 上并发执行各被预约人的 save / submit 流程"""
+        semaphore = asyncio.Semaphore(concurrency)
+        self._slots = asyncio.Semaphore(slots) if slots else None
+
+        async def submit(appointment, visitor):
+            name = self._label(appointment, visitor)
+            async with semaphore:
+                try:
+                    await self.submit_request(appointment, visitor)
+                    return (name, True, "success")
+                except Exception as e:
+                    logger.error(f"Failed: {name} - {e}")
+                    return (name, False, str(e))
+
+        results = await asyncio.gather(
+            *(submit(appointment, visitor) for appointment, visitor in visitors)
+        )
+        self._slots = None
+
+        # 部分失败时同样返回每位被预约人的结果，由调用方展示并记录
+        return list(results)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   bench.py
+# @Time    :   2025/08/26 14:02:17
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+import codes
+import limiter
+import metrics
+import simulator
+from main import STUDENT_DEFAULTS, build_session_config, create_session, reserve, reserve_async
+from session import Session
+
+# 离线压测：在本进程内启动模拟器，用真实的客户端流程（预热、定时触发、突发重试、
+# 并发提交、验证码推送）完成一次开放时刻的预约，统计每位被预约人的提交耗时。
+
+console = Console()
+
+
+def make_students(args, open_time, origin):
+    """生成压测用的学生配置，每个学生一个预约，含 visitors 个被预约人"""
+    yyrq = (open_time + timedelta(days=3)).strftime("%Y%m%d")
+    students = []
+    for i in range(args.students):
+        student = dict(STUDENT_DEFAULTS)
+        student.update(
+            {
+                "username": f"21000000{i:02d}",
+                "password": "bench",
+                "phone": "16666666666",
+                "auto": True,
+                "warmup": 0,
+                "concurrency": args.concurrency,
+                "clock_samples": 3,
+                "backend": args.backend,
+                "pipeline": not args.no_pipeline,
+                "hedge": args.hedge,
+                "session_cache": False,
+                "hosts": simulator.host_overrides(origin),
+                "appointments": [
+                    {
+                        "yyrq": yyrq,
+                        "yyxm": "东南门",
+                        "yysj": "10:00",
+                        "yysy": "压测",
+                        "mode": "燕园",
+                        "visitors": [
+                            {
+                                "name": f"访客{i:02d}-{j:02d}",
+                                "id": f"1101012000010{i:02d}{j:03d}",
+                                "phone": "11111111111",
+                            }
+                            for j in range(args.visitors)
+                        ],
+                    }
+                ],
+            }
+        )
+        students.append(student)
+    return students
+
+
+def run_student(student, open_time):
+    session_config = build_session_config(student["appointments"], student)
+    s = create_session(session_config, None)
+    try:
+        if isinstance(s, Session):
+            results, _ = reserve(s, open_time, student["clock_samples"])
+        else:
+            results, _ = asyncio.run(reserve_async(s, open_time, student["clock_samples"]))
+        return results
+    except Exception as e:
+        return str(e)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def report(open_time, students):
+    """按被预约人统计开放后首次保存成功、提交成功的耗时"""
+    t_open = open_time.timestamp()
+    saved, submitted, failures = {}, {}, 0
+    # 每位被预约人成功保存、成功提交的次数，用于检查对冲产生的重复申请与重复提交
+    saves, submits = {}, {}
+    for endpoint, student, name, at, success in simulator.state.events:
+        key = (student, name)
+        if not success:
+            failures += 1
+        elif endpoint == "saveSqxx":
+            saved.setdefault(key, at - t_open)
+            saves[key] = saves.get(key, 0) + 1
+        elif endpoint == "submitSqxx":
+            submitted.setdefault(key, at - t_open)
+            submits[key] = submits.get(key, 0) + 1
+
+    table = Table()
+    table.add_column("学生", style="cyan")
+    table.add_column("被预约人")
+    table.add_column("saveSqxx (ms)", justify="right")
+    table.add_column("submitSqxx (ms)", justify="right")
+    visitors = [
+        (student["username"], visitor["name"])
+        for student in students
+        for visitor in student["appointments"][0]["visitors"]
+    ]
+    for key in visitors:
+        table.add_row(
+            key[0],
+            key[1],
+            f"{saved[key] * 1000:.1f}" if key in saved else "[red]-[/red]",
+            f"{submitted[key] * 1000:.1f}" if key in submitted else "[red]-[/red]",
+        )
+    console.print(Panel(table, title="[bold blue]📋 每位被预约人距开放时刻的耗时[/bold blue]"))
+
+    times = list(submitted.values())
+    result = {
+        "visitors": len(visitors),
+        "submitted": len(times),
+        "failed_calls": failures,
+        "duplicate_saves": sum(count - 1 for count in saves.values()),
+        "double_submits": sum(1 for count in submits.values() if count > 1),
+        "first_submit": min(times) if times else None,
+        "p50": _percentile(times, 0.5),
+        "p95": _percentile(times, 0.95),
+        "p99": _percentile(times, 0.99),
+        "max": max(times) if times else None,
+        "phases": metrics.registry.summary()["phases"],
+    }
+
+    summary = Table(show_header=False, box=None, padding=(0, 1))
+    summary.add_column("字段", style="cyan")
+    summary.add_column("值")
+    summary.add_row("提交成功", f"{len(times)}/{len(visitors)}")
+    summary.add_row("失败的调用", str(failures))
+    summary.add_row("重复保存", str(result["duplicate_saves"]))
+    summary.add_row("重复提交", str(result["double_submits"]))
+    for field in ("first_submit", "p50", "p95", "p99", "max"):
+        value = result[field]
+        summary.add_row(field, f"{value * 1000:.1f} ms" if value is not None else "-")
+    for phase, stats in sorted(result["phases"].items()):
+        summary.add_row(
+            phase,
+            f"n={stats['count']} p50={stats['p50'] * 1000:.1f} ms "
+            f"p95={stats['p95'] * 1000:.1f} ms max={stats['max'] * 1000:.1f} ms",
+        )
+    console.print(Panel(summary, title="[bold green]📊 压测结果[/bold green]"))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于本地模拟器的端到端压测")
+    parser.add_argument("--students", type=int, default=2)
+    parser.add_argument("--visitors", type=int, default=3, help="每个学生的被预约人数量")
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--backend", choices=("requests", "httpx"), default="requests")
+    parser.add_argument("--no-pipeline", action="store_true", help="关闭验证码流水线")
+    parser.add_argument("--hedge", action="store_true", help="开启 saveSqxx / submitSqxx 对冲")
+    parser.add_argument("--open-in", type=float, default=8, help="多少秒后开放预约")
+    parser.add_argument("--port", type=int, default=simulator.DEFAULT_PORT)
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--simso-concurrency", type=int, default=None, help="simso 的并发上限")
+    parser.add_argument("--simso-rate", type=float, default=None, help="simso 每秒令牌数")
+    simulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    limits = {"concurrency": args.simso_concurrency, "rate": args.simso_rate}
+    limiter.configure({"simso.pku.edu.cn": {k: v for k, v in limits.items() if v is not None}})
+
+    open_time = datetime.now() + timedelta(seconds=args.open_in)
+    simulator.apply_arguments(args, open_time)
+    origin = simulator.start(args.port)
+    # 模拟器与客户端同进程，验证码经进程内队列直接传递
+    codes.broker.attached = True
+
+    students = make_students(args, open_time, origin)
+    console.print(
+        f"[bold blue]🏁 {args.students} 个学生 × {args.visitors} 个被预约人，"
+        f"{args.backend} 后端，{open_time:%H:%M:%S.%f} 开放[/bold blue]"
+    )
+    with ThreadPoolExecutor(max_workers=len(students)) as executor:
+        outcomes = list(executor.map(run_student, students, [open_time] * len(students)))
+    for student, outcome in zip(students, outcomes):
+        if not isinstance(outcome, list):
+            console.print(f"[red]✗ 学生 {student['username']}: {outcome}[/red]")
+
+    result = report(open_time, students)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
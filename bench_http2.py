@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   bench_http2.py
+# @Time    :   2025/08/30 11:05:27
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+
+from loguru import logger
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+import limiter
+import simulator
+from async_session import AsyncSession
+
+# 对比 HTTP/1.1 与 HTTP/2 的建连开销与突发延迟：用 hypercorn 以 TLS（ALPN 协商 h2 / http/1.1）
+# 运行本地模拟器，分别测量建立连接的耗时与连接数，以及 N 个被预约人同时 saveSqxx 的延迟。
+# 需要 pip install hypercorn 'httpx[http2]'
+
+console = Console()
+
+# HTTP 版本 -> 出现过的客户端端口（即连接）
+connections = {}
+
+
+async def counting_app(scope, receive, send):
+    """记录每个请求所在的连接，再交给模拟器处理"""
+    if scope["type"] == "http" and scope.get("client"):
+        connections.setdefault(scope["http_version"], set()).add(scope["client"][1])
+    await simulator.app(scope, receive, send)
+
+
+def make_certificate(directory):
+    """为 127.0.0.1 生成自签名证书，返回 (证书路径, 私钥路径)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return cert_path, key_path
+
+
+def start_tls_server(port, cert_path, key_path):
+    """在后台线程中以 TLS 运行模拟器，返回其地址"""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.certfile, config.keyfile = cert_path, key_path
+    config.alpn_protocols = ["h2", "http/1.1"]
+    config.loglevel = "WARNING"
+
+    def run():
+        asyncio.run(serve(counting_app, config, shutdown_trigger=lambda: asyncio.Future()))
+
+    threading.Thread(target=run, name="tls_simulator", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return f"https://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"TLS 模拟器启动失败，请检查端口 {port}")
+
+
+def make_config(origin, visitors, http2):
+    return {
+        "username": "2100000000",
+        "password": "bench",
+        "phone": "16666666666",
+        "auto": True,
+        "totp_mode": "shortcut",
+        "session_cache": False,
+        "concurrency": visitors,
+        "http2": http2,
+        "hosts": simulator.host_overrides(origin),
+        "appointments": [
+            {
+                "yyrq": "20250101",
+                "yyxm": "东南门",
+                "yysj": "10:00",
+                "yysy": "压测",
+                "mode": "燕园",
+                "visitors": [
+                    {"name": f"访客{i:02d}", "id": f"11010120000101{i:04d}", "phone": "11111111111"}
+                    for i in range(visitors)
+                ],
+            }
+        ],
+    }
+
+
+async def burst(s):
+    """所有被预约人同时 checkSqrq + saveSqxx，返回整批耗时（秒）"""
+    s._reset_status()
+    started = time.perf_counter()
+    await asyncio.gather(*(s.save_request(*pair) for pair in s._visitors()))
+    return time.perf_counter() - started
+
+
+async def measure(config, verify, rounds):
+    result = {}
+
+    # 建连：新会话同时发出 N 个 HEAD，统计耗时与服务端看到的连接数
+    connections.clear()
+    async with AsyncSession(config, verify=verify) as s:
+        started = time.perf_counter()
+        await s._ping(s._pool_size())
+        result["setup"] = time.perf_counter() - started
+        result["connections"] = sum(len(ports) for ports in connections.values())
+        result["version"] = "/".join(sorted(connections))
+
+    # 冷启动突发：登录后直接突发，除登录用的连接外需现场建连
+    cold = []
+    for _ in range(rounds):
+        async with AsyncSession(config, verify=verify) as s:
+            assert await s.login(), "登录模拟器失败"
+            cold.append(await burst(s))
+    result["cold"] = cold
+
+    # 预热后突发：连接已按并发数建立
+    async with AsyncSession(config, verify=verify) as s:
+        assert await s.login(), "登录模拟器失败"
+        await s.warm_connections()
+        await burst(s)
+        result["warm"] = [await burst(s) for _ in range(rounds)]
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/1.1 与 HTTP/2 的建连开销与突发延迟对比")
+    parser.add_argument("--visitors", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="接口基础延迟（秒）")
+    parser.add_argument("--port", type=int, default=simulator.DEFAULT_PORT + 443)
+    args = parser.parse_args()
+
+    logger.remove()
+    simulator.settings.update({"latency": args.latency, "jitter": 0})
+    # 只比较传输层，不做并发与速率限制
+    limiter.configure({"simso.pku.edu.cn": {"concurrency": None, "rate": None}})
+    cert_path, key_path = make_certificate(tempfile.mkdtemp())
+    origin = start_tls_server(args.port, cert_path, key_path)
+    verify = ssl.create_default_context(cafile=cert_path)
+
+    table = Table()
+    table.add_column("并发", justify="right")
+    table.add_column("协议", style="cyan")
+    table.add_column("连接数", justify="right")
+    table.add_column("建连 (ms)", justify="right")
+    table.add_column("冷启动突发 p50 / p95 (ms)", justify="right")
+    table.add_column("预热后突发 p50 / p95 (ms)", justify="right")
+    for visitors in args.visitors:
+        for http2 in (False, True):
+            result = asyncio.run(measure(make_config(origin, visitors, http2), verify, args.rounds))
+            table.add_row(
+                str(visitors),
+                result["version"],
+                str(result["connections"]),
+                f"{result['setup'] * 1000:.1f}",
+                f"{percentile(result['cold'], 0.5) * 1000:.1f} / {percentile(result['cold'], 0.95) * 1000:.1f}",
+                f"{percentile(result['warm'], 0.5) * 1000:.1f} / {percentile(result['warm'], 0.95) * 1000:.1f}",
+            )
+    console.print(
+        Panel(
+            table,
+            title=f"[bold blue]HTTP/1.1 vs HTTP/2（接口延迟 {args.latency * 1000:.0f} ms，{args.rounds} 轮）[/bold blue]",
+        )
+    )
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   bench_logging.py
+# @Time    :   2025/08/27 11:20:39
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import os
+import tempfile
+import time
+from contextlib import nullcontext
+
+from loguru import logger
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+import simulator
+from quiet import DeferredConsole
+from session import Session
+
+# 测量静默窗口对每个请求的额外开销：对本地模拟器（零延迟）反复发送 getJrsqxx，
+# 每个请求后写一条 DEBUG 日志并渲染一个 rich 面板，与不写日志、不输出的基线对比。
+
+FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+
+
+def make_session(origin):
+    config = {
+        "username": "2100000000",
+        "password": "bench",
+        "phone": "16666666666",
+        "session_cache": False,
+        "hosts": simulator.host_overrides(origin),
+        "appointments": [],
+    }
+    s = Session(config)
+    assert s.login(), "登录模拟器失败"
+    return s
+
+
+def panel(i):
+    table = Table()
+    table.add_column("被预约人", style="cyan")
+    table.add_column("状态", style="bold")
+    table.add_row(f"访客{i}", "[green]✓ 成功[/green]")
+    return Panel(table, title="[bold blue]📋 提交结果[/bold blue]")
+
+
+def run(s, requests, log_file=None, enqueue=False, console=None, deferred=False):
+    """返回每个请求（含日志与输出）的耗时列表（秒）"""
+    logger.remove()
+    if log_file:
+        logger.add(
+            log_file,
+            rotation="1 day",
+            retention="7 days",
+            level="DEBUG",
+            format=FORMAT,
+            enqueue=enqueue,
+        )
+
+    timings = []
+    with console.hold() if deferred else nullcontext():
+        for i in range(requests):
+            started = time.perf_counter()
+            s.login_check()
+            if log_file:
+                logger.debug(f"getJrsqxx 第 {i} 次完成")
+            if console:
+                console.print(panel(i))
+            timings.append(time.perf_counter() - started)
+    # 静默窗口结束后的渲染与后台写入不计入请求耗时
+    logger.complete()
+    logger.remove()
+    return timings
+
+
+def stats(timings):
+    values = sorted(timings)
+    return (
+        sum(values) / len(values),
+        values[len(values) // 2],
+        values[min(int(len(values) * 0.95), len(values) - 1)],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="静默窗口的日志 / 输出开销测量")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--port", type=int, default=simulator.DEFAULT_PORT)
+    args = parser.parse_args()
+
+    simulator.settings.update({"latency": 0, "jitter": 0})
+    s = make_session(simulator.start(args.port))
+    log_file = os.path.join(tempfile.mkdtemp(), "reservation.log")
+
+    with open(os.devnull, "w") as devnull:
+        modes = {
+            "基线（无日志、无输出）": {},
+            "同步写日志 + 直接渲染": {
+                "log_file": log_file,
+                "console": Console(file=devnull, force_terminal=True, width=100),
+            },
+            "后台写日志 + 延后渲染": {
+                "log_file": log_file,
+                "enqueue": True,
+                "console": DeferredConsole(file=devnull, force_terminal=True, width=100),
+                "deferred": True,
+            },
+        }
+        # 预热连接与代码路径
+        run(s, 50)
+        results = {name: stats(run(s, args.requests, **kwargs)) for name, kwargs in modes.items()}
+
+    baseline = results["基线（无日志、无输出）"][0]
+    table = Table()
+    table.add_column("模式", style="cyan")
+    table.add_column("均值 (µs)", justify="right")
+    table.add_column("p50 (µs)", justify="right")
+    table.add_column("p95 (µs)", justify="right")
+    table.add_column("额外开销 (µs)", justify="right")
+    for name, (mean, p50, p95) in results.items():
+        table.add_row(
+            name,
+            f"{mean * 1e6:.0f}",
+            f"{p50 * 1e6:.0f}",
+            f"{p95 * 1e6:.0f}",
+            f"{(mean - baseline) * 1e6:+.0f}",
+        )
+    Console().print(Panel(table, title=f"[bold blue]每个请求的耗时（{args.requests} 次）[/bold blue]"))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   bench_prepare.py
+# @Time    :   2025/08/29 10:26:51
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import asyncio
+import time
+
+from loguru import logger
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+import simulator
+from async_session import AsyncSession
+from session import Session
+
+# 测量预先构造请求从开放时刻移除的客户端 CPU 时间：对本地模拟器（零延迟）反复执行
+# 每位被预约人开放时刻的 checkSqrq + saveSqxx，按线程 CPU 时间统计，与现场构造请求对比。
+
+
+def make_config(origin, visitors):
+    return {
+        "username": "2100000000",
+        "password": "bench",
+        "phone": "16666666666",
+        "auto": True,
+        "totp_mode": "shortcut",
+        "session_cache": False,
+        "hosts": simulator.host_overrides(origin),
+        "appointments": [
+            {
+                "yyrq": "20250101",
+                "yyxm": "东南门",
+                "yysj": "10:00",
+                "yysy": "压测",
+                "mode": "燕园",
+                "visitors": [
+                    {"name": f"访客{i:02d}", "id": f"11010120000101{i:04d}", "phone": "11111111111"}
+                    for i in range(visitors)
+                ],
+            }
+        ],
+    }
+
+
+def run_sync(s, rounds, prepared):
+    """返回每位被预约人 checkSqrq + saveSqxx 的线程 CPU 时间（秒）"""
+    if prepared:
+        s.prepare()
+    else:
+        s._prepared, s._visitor_list = {}, None
+    timings = []
+    for _ in range(rounds):
+        for appointment, visitor in s._visitors():
+            s._reset_status()
+            started = time.thread_time()
+            s.save_request(appointment, visitor)
+            timings.append(time.thread_time() - started)
+    return timings
+
+
+async def run_async(s, rounds, prepared):
+    if prepared:
+        s.prepare()
+    else:
+        s._prepared, s._visitor_list = {}, None
+    timings = []
+    for _ in range(rounds):
+        for appointment, visitor in s._visitors():
+            s._reset_status()
+            started = time.thread_time()
+            await s.save_request(appointment, visitor)
+            timings.append(time.thread_time() - started)
+    return timings
+
+
+async def measure_async(config, rounds):
+    async with AsyncSession(config) as s:
+        assert await s.login(), "登录模拟器失败"
+        await run_async(s, 10, False)
+        return {
+            prepared: await run_async(s, rounds, prepared) for prepared in (False, True)
+        }
+
+
+def stats(timings):
+    values = sorted(timings)
+    return sum(values) / len(values), values[len(values) // 2], values[int(len(values) * 0.95)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="预先构造请求节省的客户端 CPU 时间")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--visitors", type=int, default=3)
+    parser.add_argument("--port", type=int, default=simulator.DEFAULT_PORT)
+    args = parser.parse_args()
+
+    logger.remove()
+    simulator.settings.update({"latency": 0, "jitter": 0})
+    config = make_config(simulator.start(args.port), args.visitors)
+
+    results = {}
+    s = Session(config)
+    assert s.login(), "登录模拟器失败"
+    # 预热连接与代码路径
+    run_sync(s, 10, False)
+    for prepared in (False, True):
+        results[("requests", prepared)] = stats(run_sync(s, args.rounds, prepared))
+    for prepared, timings in asyncio.run(measure_async(config, args.rounds)).items():
+        results[("httpx", prepared)] = stats(timings)
+
+    table = Table()
+    table.add_column("后端", style="cyan")
+    table.add_column("请求", style="cyan")
+    table.add_column("均值 (µs)", justify="right")
+    table.add_column("p50 (µs)", justify="right")
+    table.add_column("p95 (µs)", justify="right")
+    table.add_column("节省 (µs)", justify="right")
+    for (backend, prepared), (mean, p50, p95) in results.items():
+        baseline = results[(backend, False)][0]
+        table.add_row(
+            backend,
+            "预先构造" if prepared else "现场构造",
+            f"{mean * 1e6:.0f}",
+            f"{p50 * 1e6:.0f}",
+            f"{p95 * 1e6:.0f}",
+            f"{(baseline - mean) * 1e6:.0f}" if prepared else "-",
+        )
+    Console().print(
+        Panel(
+            table,
+            title=f"[bold blue]每位被预约人 checkSqrq + saveSqxx 的客户端 CPU 时间（{args.rounds} 轮 × {args.visitors} 人）[/bold blue]",
+        )
+    )
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   bench_sms.py
+# @Time    :   2025/08/31 10:12:44
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib import parse
+
+import httpx
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+# 短信接收服务压测：在子进程中运行 server.py（uvicorn），模拟大量转发手机同时 POST /pku_sms，
+# 部分请求为转发端重试（相同内容），统计吞吐量与延迟分位数；服务端支持长轮询时，
+# 另测从 POST 到长轮询方拿到验证码的延迟。
+# 与旧版本对比：将旧版 server.py 放到其它目录，用 --app-dir 指定该目录。
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456"
+CONTENT = "【北京大学】您的北京大学App验证码为：{code}，请在2分钟内完成操作，否则验证码将失效。"
+
+console = Console()
+
+
+def start_server(app, app_dir, port, workdir):
+    """在子进程中启动服务，返回 (进程, 地址)"""
+    env = dict(
+        os.environ,
+        PKU_SMS_TOKEN=TOKEN,
+        PKU_CODE_SOCKET_DIR=workdir,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"短信接收服务启动失败，请检查 {app} 与端口 {port}")
+
+
+def make_messages(total, students, duplicate_rate):
+    """生成 (学号, 短信内容)，duplicate_rate 比例的请求重复前一条（转发端重试）"""
+    messages = []
+    for _ in range(total):
+        if messages and random.random() < duplicate_rate:
+            messages.append(random.choice(messages[-students:]))
+        else:
+            student_id = f"21000{random.randrange(students):05d}"
+            messages.append((student_id, CONTENT.format(code=f"{random.randrange(10**6):06d}")))
+    return messages
+
+
+async def post(reader, writer, host, student_id, content):
+    """在 keep-alive 连接上发出一个 POST /pku_sms，返回状态码
+
+    压测端与服务端可能共用 CPU，用最简的 HTTP/1.1 客户端减少压测端自身的开销。
+    """
+    body = json.dumps({"id": student_id, "content": content}).encode()
+    writer.write(
+        (
+            f"POST /pku_sms HTTP/1.1\r\nHost: {host}\r\nAuthorization: {TOKEN}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode()
+        + body
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(head.split(b" ", 2)[1])
+
+
+async def flood(origin, messages, concurrency):
+    """以 concurrency 个连接发出全部请求，返回 (总耗时, 每个请求的延迟, 失败数)"""
+    address = parse.urlparse(origin)
+    pending = iter(messages)
+    latencies = []
+    failures = 0
+
+    async def client():
+        nonlocal failures
+        reader, writer = await asyncio.open_connection(address.hostname, address.port)
+        for student_id, content in pending:
+            started = time.perf_counter()
+            status = await post(reader, writer, address.netloc, student_id, content)
+            latencies.append(time.perf_counter() - started)
+            failures += status != 200
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, failures
+
+
+async def delivery(origin, rounds):
+    """长轮询方等待验证码，返回从 POST 发出到拿到验证码的延迟；不支持长轮询时返回 None"""
+    headers = {"Authorization": TOKEN}
+    async with httpx.AsyncClient(base_url=origin, timeout=30) as c:
+        r = await c.get("/pku_sms/2199999999?timeout=0", headers=headers)
+        if r.status_code not in (200, 204):
+            return None
+        latencies = []
+        for i in range(rounds):
+            student_id = f"2199{i:06d}"
+            poller = asyncio.ensure_future(
+                c.get(f"/pku_sms/{student_id}?timeout=10", headers=headers)
+            )
+            # 等长轮询请求到达服务端
+            await asyncio.sleep(0.02)
+            started = time.perf_counter()
+            await c.post(
+                "/pku_sms",
+                json={"id": student_id, "content": CONTENT.format(code=f"{i:06d}")},
+                headers=headers,
+            )
+            r = await poller
+            assert r.status_code == 200 and r.json()["code"] == f"{i:06d}", r.text
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="短信接收服务的吞吐量与延迟")
+    parser.add_argument("--app", default="server:app")
+    parser.add_argument("--app-dir", default=ROOT, help="server.py 所在目录")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64, help="同时发送的连接数")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="转发端重试的比例")
+    parser.add_argument("--rounds", type=int, default=50, help="长轮询送达延迟的测量次数")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    random.seed(0)
+    workdir = tempfile.mkdtemp()
+    process, origin = start_server(args.app, args.app_dir, args.port, workdir)
+    try:
+        # 预热连接与代码路径
+        asyncio.run(flood(origin, make_messages(200, args.students, 0), args.concurrency))
+        messages = make_messages(args.requests, args.students, args.duplicate_rate)
+        elapsed, latencies, failures = asyncio.run(flood(origin, messages, args.concurrency))
+        delivered = asyncio.run(delivery(origin, args.rounds))
+    finally:
+        process.terminate()
+        process.wait()
+
+    table = Table()
+    table.add_column("指标", style="cyan")
+    table.add_column("数值", justify="right")
+    table.add_row("请求数", str(len(latencies)))
+    table.add_row("失败数", str(failures))
+    table.add_row("吞吐量 (req/s)", f"{len(latencies) / elapsed:.0f}")
+    for q in (0.5, 0.9, 0.99):
+        table.add_row(f"p{q * 100:g} (ms)", f"{percentile(latencies, q) * 1000:.2f}")
+    table.add_row("最大 (ms)", f"{max(latencies) * 1000:.2f}")
+    if delivered:
+        table.add_row(
+            "长轮询送达 p50 / p99 (ms)",
+            f"{percentile(delivered, 0.5) * 1000:.2f} / {percentile(delivered, 0.99) * 1000:.2f}",
+        )
+    else:
+        table.add_row("长轮询送达", "不支持")
+    console.print(
+        Panel(
+            table,
+            title=f"[bold blue]{args.app}（{args.app_dir}）：{args.concurrency} 并发，重试比例 {args.duplicate_rate:.0%}[/bold blue]",
+        )
+    )
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   clock.py
+# @Time    :   2025/08/21 10:32:08
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import threading
+from collections import deque
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+
+# 最多保留的采样数
+MAX_SAMPLES = 64
+
+
+class ClockOffsetEstimator:
+    """基于服务器响应时间戳估计服务器时钟相对本地时钟的偏移
+
+    每个采样给出偏移的一个区间：服务器在请求发出与响应收到之间生成时间戳，
+    因此 offset ∈ [ts - t_recv, ts + resolution - t_send]。对所有区间取交集
+    即为估计值，交集的半宽即为不确定度（与 NTP 的 RTT/2 修正等价）。
+    simso json 的 timestamp 精度为 1 ms，HTTP Date 头精度为 1 s。
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES) -> None:
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add_sample(self, t_send, t_recv, server_time, resolution=0.0):
+        """添加一个采样，时间均为 epoch 秒"""
+        with self._lock:
+            self._samples.append(
+                (server_time - t_recv, server_time + resolution - t_send)
+            )
+
+    def add_response(self, res, json=None):
+        """从响应中采样：优先使用 json 中的毫秒 timestamp，否则使用 Date 头
+
+        res 需带有 Session 记录的 t_send / t_recv 属性。
+        """
+        t_send = getattr(res, "t_send", None)
+        t_recv = getattr(res, "t_recv", None)
+        if t_send is None or t_recv is None:
+            return
+
+        timestamp = json.get("timestamp") if json else None
+        if isinstance(timestamp, (int, float)):
+            self.add_sample(t_send, t_recv, timestamp / 1000, resolution=0.001)
+            return
+
+        date = res.headers.get("Date")
+        if date:
+            try:
+                server_time = parsedate_to_datetime(date).timestamp()
+            except (TypeError, ValueError):
+                return
+            self.add_sample(t_send, t_recv, server_time, resolution=1.0)
+
+    def estimate(self):
+        """返回 (offset, uncertainty)，单位秒；offset 为正表示服务器时钟更快"""
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return 0.0, float("inf")
+
+        low = max(lo for lo, _ in samples)
+        high = min(hi for _, hi in samples)
+        if low > high:
+            # 区间不相交（网络抖动或服务器时钟跳变），退回最窄的单个区间
+            low, high = min(samples, key=lambda sample: sample[1] - sample[0])
+        return (low + high) / 2, (high - low) / 2
+
+    @property
+    def offset(self):
+        return self.estimate()[0]
+
+    @property
+    def uncertainty(self):
+        return self.estimate()[1]
+
+    def to_local(self, server_moment):
+        """将服务器时钟下的时刻换算为本地时钟下的时刻"""
+        return server_moment - timedelta(seconds=self.offset)
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   codes.py
+# @Time    :   2025/08/21 16:47:20
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import asyncio
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+from loguru import logger
+
+# 验证码 Unix socket 所在目录，每个学号一个 socket
+SOCKET_DIR = os.environ.get("PKU_CODE_SOCKET_DIR", tempfile.gettempdir())
+# 等待验证码的最长秒数
+CODE_TIMEOUT = 60
+# 验证码有效期（秒），与短信中的“2分钟内完成操作”一致
+CODE_TTL = 120
+# 每个学号最多保留的近期验证码数
+MAX_CODES = 16
+# 流水线模式下等待者多久（秒）没有分配到验证码时，改用登记之后到达、尚未确认使用的验证码
+CODE_GRACE = 10
+
+
+class CodeTimeoutError(Exception):
+    """在限定时间内没有收到验证码"""
+
+    def __init__(self, student_id, timeout) -> None:
+        self.student_id = student_id
+        super().__init__(f"{timeout} 秒内未收到学号 {student_id} 的验证码")
+
+
+def resolve_future(future):
+    """在 future 所属的事件循环中执行：尚未完成时置为完成，唤醒等待它的协程
+
+    线程与协程共用的等待原语（CodeLock、Ticket、limiter.HostGate）经
+    loop.call_soon_threadsafe(resolve_future, future) 跨线程唤醒协程。
+    """
+    if not future.done():
+        future.set_result(None)
+
+
+class CodeLock:
+    """同一学号的验证码锁，线程与协程都可以等待
+
+    线程在 Condition 上等待；协程在各自事件循环的 future 上等待，释放时经
+    call_soon_threadsafe 唤醒，不占用线程池。
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._locked = False
+        # 正在等待的协程：[(事件循环, future)]
+        self._futures = []
+
+    def acquire(self):
+        with self._cond:
+            while self._locked:
+                self._cond.wait()
+            self._locked = True
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if not self._locked:
+                    self._locked = True
+                    return
+                future = loop.create_future()
+                self._futures.append((loop, future))
+            await future
+
+    def release(self):
+        with self._cond:
+            self._locked = False
+            self._cond.notify()
+            for loop, future in self._futures:
+                loop.call_soon_threadsafe(resolve_future, future)
+            self._futures = []
+
+
+# 同一学号的验证码文件只能串行使用，多个预约任务并行时共享同一把锁
+_code_locks = defaultdict(CodeLock)
+_code_locks_guard = threading.Lock()
+
+
+def lock_for(student_id):
+    with _code_locks_guard:
+        return _code_locks[str(student_id)]
+
+
+def socket_path(student_id):
+    return os.path.join(SOCKET_DIR, f"pku-auto-reservation-{student_id}.sock")
+
+
+class Ticket:
+    """流水线模式下一个 sqxxid 对应的验证码等待者，线程与协程都可以等待"""
+
+    def __init__(self) -> None:
+        self.code = None
+        self.created = time.monotonic()
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        # 正在等待的协程：[(事件循环, future)]
+        self._futures = []
+
+    def set(self, code):
+        with self._lock:
+            self.code = code
+            self._event.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(resolve_future, future)
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """在事件循环中等待验证码，不占用线程池"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._event.is_set():
+                return True
+            future = loop.create_future()
+            self._futures.append((loop, future))
+        await asyncio.wait([future], timeout=timeout)
+        return self._event.is_set()
+
+
+class CodeBroker:
+    """进程内的验证码通道，按学号分队列，验证码到达即唤醒等待方
+
+    流水线模式下同一学号可有多个等待者，验证码按到达顺序分配给最早登记的等待者。
+    短信迟到或丢失时按顺序分配会错位，因此另外保留近期收到、尚未确认使用的验证码，
+    提交返回验证码错误时可以改用其中的其它验证码。
+    """
+
+    def __init__(self) -> None:
+        self._queues = defaultdict(queue.Queue)
+        self._tickets = defaultdict(deque)
+        # 学号 -> deque[(验证码, 收到时间)]，确认使用后移除
+        self._recent = defaultdict(lambda: deque(maxlen=MAX_CODES))
+        # 学号 -> [Ticket]，下一个验证码到达时全部唤醒，不占用验证码
+        self._observers = defaultdict(list)
+        self._lock = threading.Lock()
+        # server.py 与 main.py 运行在同一进程时置为 True，验证码直接走队列
+        self.attached = False
+
+    def _queue(self, student_id):
+        with self._lock:
+            return self._queues[str(student_id)]
+
+    def publish(self, student_id, code):
+        student_id = str(student_id)
+        with self._lock:
+            self._recent[student_id].append((code, time.monotonic()))
+            observers = self._observers.pop(student_id, [])
+            tickets = self._tickets[student_id]
+            ticket = tickets.popleft() if tickets else None
+        for observer in observers:
+            observer.set(code)
+        if ticket:
+            ticket.set(code)
+        else:
+            self._queue(student_id).put(code)
+
+    def recent(self, student_id, exclude=(), since=None):
+        """近期收到、尚未确认使用且未过期的验证码，按到达顺序排列
+
+        since 为 time.monotonic() 时刻，只返回此后到达的验证码。
+        """
+        since = max(time.monotonic() - CODE_TTL, since or 0)
+        with self._lock:
+            return [
+                code
+                for code, received_at in self._recent[str(student_id)]
+                if received_at >= since and code not in exclude
+            ]
+
+    def observe(self, student_id):
+        """登记一个观察者，下一个验证码到达时被唤醒，验证码仍按顺序分配"""
+        ticket = Ticket()
+        with self._lock:
+            self._observers[str(student_id)].append(ticket)
+        return ticket
+
+    def unobserve(self, student_id, ticket):
+        with self._lock:
+            observers = self._observers[str(student_id)]
+            if ticket in observers:
+                observers.remove(ticket)
+
+    def used(self, student_id, code):
+        """确认验证码已被使用，不再作为其它等待者的候选"""
+        with self._lock:
+            recent = self._recent[str(student_id)]
+            for entry in [entry for entry in recent if entry[0] == code]:
+                recent.remove(entry)
+
+    def expect(self, student_id):
+        """登记一个等待者，返回 (ticket, 是否为当前唯一的等待者)"""
+        ticket = Ticket()
+        with self._lock:
+            tickets = self._tickets[str(student_id)]
+            tickets.append(ticket)
+            return ticket, len(tickets) == 1
+
+    def cancel(self, student_id, ticket):
+        """撤销等待者，返回 False 表示验证码已分配给它"""
+        with self._lock:
+            try:
+                self._tickets[str(student_id)].remove(ticket)
+                return True
+            except ValueError:
+                return False
+
+    def clear(self, student_id):
+        """丢弃尚未取走的旧验证码"""
+        q = self._queue(student_id)
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+    def wait(self, student_id, timeout=None):
+        """等待验证码，超时返回 None"""
+        try:
+            return self._queue(student_id).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+broker = CodeBroker()
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+# 多个等待者同时回退读取验证码文件时，同一个验证码只能分配一次
+_file_lock = threading.Lock()
+
+
+def listen(student_id):
+    """为学号启动 Unix socket 监听线程，收到的验证码转发到进程内队列
+
+    不支持 Unix socket 或绑定失败时返回 False，此时仅依赖验证码文件。
+    """
+    student_id = str(student_id)
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+
+    with _listeners_lock:
+        if student_id in _listeners:
+            return True
+
+        path = socket_path(student_id)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+            sock.bind(path)
+        except OSError as e:
+            sock.close()
+            logger.warning(f"无法监听验证码 socket {path}: {e}，将回退到验证码文件")
+            return False
+
+        thread = threading.Thread(
+            target=_serve, args=(sock, student_id), name=f"codes_{student_id}", daemon=True
+        )
+        _listeners[student_id] = sock
+        thread.start()
+        logger.debug(f"验证码 socket 已监听: {path}")
+        return True
+
+
+def _serve(sock, student_id):
+    while True:
+        try:
+            data = sock.recv(1024)
+        except OSError:
+            return
+        code = data.decode(errors="ignore").strip()
+        if code:
+            broker.publish(student_id, code)
+
+
+def push(student_id, code):
+    """将验证码推送给等待方，成功返回 True
+
+    同进程时直接放入队列，否则发送到学号对应的 Unix socket。
+    """
+    if broker.attached:
+        broker.publish(student_id, code)
+        return True
+
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        # 接收方缓冲区已满时不阻塞调用方（server.py 的事件循环），回退到验证码文件
+        sock.setblocking(False)
+        try:
+            sock.sendto(str(code).encode(), socket_path(student_id))
+            return True
+        except OSError:
+            return False
+
+
+def reset(student_id):
+    """清空学号特定的验证码文件与推送队列中的旧验证码"""
+    with open(f"{student_id}.txt", "w") as f:
+        f.write("")
+    broker.clear(student_id)
+
+
+def wait_for_code(student_id, timeout=CODE_TIMEOUT):
+    """阻塞等待学号对应的验证码，超时抛出 CodeTimeoutError
+
+    优先等待推送通道，验证码到达即唤醒；每秒回退检查一次学号特定的验证码文件。
+    """
+    code_file = f"{student_id}.txt"
+    code = ""
+    for i in range(timeout):
+        code = broker.wait(student_id, timeout=1)
+        if code:
+            break
+
+        try:
+            with open(code_file, "r") as f:
+                code = f.read().strip()
+            if code:
+                break
+        except FileNotFoundError:
+            # 如果文件不存在，创建一个空文件
+            with open(code_file, "w") as f:
+                f.write("")
+
+        if i % 10 == 0:  # 每10秒输出一次等待信息
+            logger.info(
+                f"Waiting for code for student {student_id}... ({i + 1}/{timeout}s)"
+            )
+
+    # 清空验证码文件
+    with open(code_file, "w") as f:
+        f.write("")
+
+    if not code:
+        raise CodeTimeoutError(student_id, timeout)
+    return code
+
+
+def expect(student_id):
+    """流水线模式：在 sendEcyzCode 之前登记等待者
+
+    没有其它等待者时清空旧验证码；已有等待者时保留文件与队列，以免丢掉它们的验证码。
+    """
+    ticket, first = broker.expect(student_id)
+    if first:
+        reset(student_id)
+    return ticket
+
+
+def cancel(student_id, ticket):
+    broker.cancel(student_id, ticket)
+
+
+def confirm(student_id, code):
+    """提交成功后确认验证码已使用"""
+    broker.used(student_id, code)
+
+
+def _claim_file(student_id):
+    """读取并清空验证码文件，读到的验证码按顺序分配给等待者"""
+    code_file = f"{student_id}.txt"
+    with _file_lock:
+        try:
+            with open(code_file, "r") as f:
+                code = f.read().strip()
+            if code:
+                with open(code_file, "w") as f:
+                    f.write("")
+                broker.publish(student_id, code)
+        except FileNotFoundError:
+            with open(code_file, "w") as f:
+                f.write("")
+
+
+def _reassign(student_id, ticket, waited):
+    """等待超过 CODE_GRACE 秒时，改用登记之后到达、尚未确认使用的验证码
+
+    前一位的短信丢失或迟到后被撤销时，本该属于自己的验证码可能已按顺序分配给他人；
+    此时撤销 ticket，不让整条队列因一次错位而等到超时。验证码不对时由提交方换用其它验证码。
+    """
+    if waited < CODE_GRACE:
+        return None
+    candidates = broker.recent(student_id, since=ticket.created)
+    if not candidates:
+        return None
+    # 撤销失败说明验证码恰好在此时分配给了 ticket
+    if not broker.cancel(student_id, ticket):
+        return ticket.code
+    return candidates[0]
+
+
+def wait_for_ticket(student_id, ticket, timeout=CODE_TIMEOUT):
+    """等待分配给 ticket 的验证码，超时抛出 CodeTimeoutError
+
+    推送通道的验证码直接分配；每秒回退检查一次验证码文件，读到后同样按顺序分配。
+    """
+    for i in range(timeout):
+        if ticket.wait(1):
+            return ticket.code
+
+        _claim_file(student_id)
+        code = _reassign(student_id, ticket, i + 1)
+        if code:
+            return code
+
+        if i % 10 == 0:
+            logger.info(
+                f"Waiting for code for student {student_id}... ({i + 1}/{timeout}s)"
+            )
+
+    # 撤销失败说明验证码恰好在超时时到达
+    if not broker.cancel(student_id, ticket):
+        return ticket.code
+    raise CodeTimeoutError(student_id, timeout)
+
+
+async def wait_for_ticket_async(student_id, ticket, timeout=CODE_TIMEOUT):
+    """wait_for_ticket 的协程版本：在事件循环中等待推送，每秒检查一次验证码文件"""
+    for i in range(timeout):
+        if await ticket.wait_async(1):
+            return ticket.code
+
+        _claim_file(student_id)
+        code = _reassign(student_id, ticket, i + 1)
+        if code:
+            return code
+
+        if i % 10 == 0:
+            logger.info(
+                f"Waiting for code for student {student_id}... ({i + 1}/{timeout}s)"
+            )
+
+    if not broker.cancel(student_id, ticket):
+        return ticket.code
+    raise CodeTimeoutError(student_id, timeout)
+
+
+def wait_for_other(student_id, tried, timeout=CODE_TIMEOUT):
+    """流水线模式下验证码被判错误时，返回该学号其它尚未确认使用的验证码
+
+    前一位的短信迟到或丢失时，按顺序分配的验证码会错位，本该属于自己的验证码
+    可能已分配给他人或尚未到达；tried 中的验证码不再返回，超时抛出 CodeTimeoutError。
+    """
+    for i in range(timeout):
+        observer = broker.observe(student_id)
+        try:
+            # 登记观察者之后再检查，不会漏掉两者之间到达的验证码
+            candidates = broker.recent(student_id, tried)
+            if candidates:
+                return candidates[0]
+            observer.wait(1)
+        finally:
+            broker.unobserve(student_id, observer)
+
+        _claim_file(student_id)
+
+        if i % 10 == 0:
+            logger.info(
+                f"Waiting for another code for student {student_id}... ({i + 1}/{timeout}s)"
+            )
+
+    candidates = broker.recent(student_id, tried)
+    if candidates:
+        return candidates[0]
+    raise CodeTimeoutError(student_id, timeout)
+
+
+async def wait_for_other_async(student_id, tried, timeout=CODE_TIMEOUT):
+    """wait_for_other 的协程版本"""
+    for i in range(timeout):
+        observer = broker.observe(student_id)
+        try:
+            candidates = broker.recent(student_id, tried)
+            if candidates:
+                return candidates[0]
+            await observer.wait_async(1)
+        finally:
+            broker.unobserve(student_id, observer)
+
+        _claim_file(student_id)
+
+        if i % 10 == 0:
+            logger.info(
+                f"Waiting for another code for student {student_id}... ({i + 1}/{timeout}s)"
+            )
+
+    candidates = broker.recent(student_id, tried)
+    if candidates:
+        return candidates[0]
+    raise CodeTimeoutError(student_id, timeout)
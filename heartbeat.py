@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   heartbeat.py
+# @Time    :   2025/08/28 09:47:12
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+import limiter
+from session import Session
+
+# 心跳间隔（秒）：sid 持续有效时从最小值逐步翻倍到最大值，失效后回到最小值
+HEARTBEAT_MIN_INTERVAL = 60
+HEARTBEAT_MAX_INTERVAL = 900
+# 预计 sid 过期前多少秒主动重新登录
+REAUTH_MARGIN = 120
+# 两次 IAAA 登录的最小间隔（秒），登录失败时按此间隔翻倍退避
+MIN_LOGIN_INTERVAL = 300
+# 预热前 WINDOW_LEAD 秒到开放后 WINDOW_TAIL 秒交给预约任务，心跳暂停
+WINDOW_LEAD = 180
+WINDOW_TAIL = 120
+
+
+class Heartbeat:
+    """学生有待执行的预约时，在后台定期调用 login_check 保持会话缓存中的 sid 有效
+
+    以 sid 签发后仍有效的最长时长、已失效的最短时长夹逼 sid 的寿命，在两者之间
+    加测以收紧估计；预计 sid 会在预约窗口结束前过期时，在窗口开始前主动重新登录。
+    登录结果写入会话缓存，预约任务预热时直接复用。
+    """
+
+    def __init__(self, session_config, windows) -> None:
+        self.config = session_config
+        self._session = Session(session_config)
+        self._student_id = session_config["username"]
+        # [(预热时刻, 开放时刻)]，按时间排序
+        self._windows = sorted(windows)
+        # sid 寿命的下界（签发后确认有效的最长时长）与上界（签发后已失效的最短时长），秒
+        self.lifetime_lo = None
+        self.lifetime_hi = None
+        self.interval = HEARTBEAT_MIN_INTERVAL
+        self._last_login = None
+        self._login_backoff = MIN_LOGIN_INTERVAL
+        self._stop = threading.Event()
+        # 窗口变化或停止时唤醒等待中的心跳线程
+        self._wake = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"heartbeat_{self._student_id}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def set_windows(self, windows):
+        """配置重新加载后更新预约窗口"""
+        self._windows = sorted(windows)
+        self._wake.set()
+
+    def _sleep(self, seconds):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    @property
+    def lifetime(self):
+        """sid 寿命的保守估计，尚未观察到失效时为 None"""
+        return self.lifetime_lo if self.lifetime_hi is not None else None
+
+    def _converged(self):
+        return self.lifetime is not None and self.lifetime_hi - self.lifetime_lo <= REAUTH_MARGIN
+
+    def _next_window(self, now):
+        """返回尚未结束的最近一个窗口 (开始, 结束)，没有时返回 None"""
+        for warmup_time, open_time in self._windows:
+            end = open_time + timedelta(seconds=WINDOW_TAIL)
+            if end > now:
+                return warmup_time - timedelta(seconds=WINDOW_LEAD), end
+        return None
+
+    def _expiry(self):
+        """预计的 sid 过期时刻（本地时间戳），寿命未知时返回 None"""
+        issued_at = self._session.sid_issued_at
+        if self.lifetime is None or issued_at is None:
+            return None
+        return issued_at + self.lifetime
+
+    def _run(self):
+        # 心跳的请求排在所有预约请求之后
+        with limiter.background():
+            self._loop()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = datetime.now()
+            window = self._next_window(now)
+            if window is None:
+                logger.debug(f"学生 {self._student_id} 已无待执行的预约，心跳结束")
+                return
+            start, end = window
+            if start <= now:
+                # 预约任务正在使用会话，等窗口结束
+                self._sleep((end - now).total_seconds())
+                continue
+
+            self._beat(start.timestamp(), end.timestamp())
+            self._sleep(self._next_delay(start.timestamp()))
+
+    def _beat(self, window_start, window_end):
+        s = self._session
+        try:
+            if "sid" not in s.params:
+                self._login(force=False)
+                return
+            ok = s.login_check()
+        except Exception as e:
+            # 网络错误不代表 sid 失效，缩短间隔稍后再试
+            logger.warning(f"学生 {self._student_id} 心跳失败: {e}")
+            self.interval = HEARTBEAT_MIN_INTERVAL
+            return
+
+        now = time.time()
+        age = now - s.sid_issued_at if s.sid_issued_at is not None else None
+        if ok:
+            self.interval = min(self.interval * 2, HEARTBEAT_MAX_INTERVAL)
+            if age is not None and (self.lifetime_lo is None or age > self.lifetime_lo):
+                self.lifetime_lo = age
+            expiry = self._expiry()
+            if expiry is None:
+                return
+            # 将在窗口结束前过期且窗口即将开始，或寿命已估准且即将过期：主动重新登录
+            if (expiry < window_end and window_start - now <= REAUTH_MARGIN) or (
+                self._converged() and expiry - REAUTH_MARGIN <= now
+            ):
+                logger.info(
+                    f"学生 {self._student_id} 的 sid 预计 {datetime.fromtimestamp(expiry):%Y-%m-%d %H:%M:%S} 过期，主动重新登录"
+                )
+                self._login(force=True)
+            return
+
+        # sid 已失效：比已知有效时长还短的失效（如在别处登录被顶掉）不计入寿命
+        if age is not None and (self.lifetime_lo is None or age > self.lifetime_lo):
+            if self.lifetime_hi is None or age < self.lifetime_hi:
+                self.lifetime_hi = age
+            logger.info(
+                f"学生 {self._student_id} 的 sid 在签发 {age:.0f} 秒内失效，"
+                f"寿命估计 {self.lifetime_lo or 0:.0f}~{self.lifetime_hi:.0f} 秒"
+            )
+        self.interval = HEARTBEAT_MIN_INTERVAL
+        self._login(force=True)
+
+    def _login(self, force):
+        """登录并写入会话缓存，受最小登录间隔限制，避免频繁访问 IAAA"""
+        now = time.time()
+        if force and self._last_login is not None and now - self._last_login < self._login_backoff:
+            return False
+        self._last_login = now
+        try:
+            ok = self._session.ensure_login(force=force)
+        except Exception as e:
+            logger.warning(f"学生 {self._student_id} 心跳登录失败: {e}")
+            ok = False
+        if ok:
+            self._login_backoff = MIN_LOGIN_INTERVAL
+        else:
+            self._login_backoff = min(self._login_backoff * 2, HEARTBEAT_MAX_INTERVAL * 4)
+        return ok
+
+    def _next_delay(self, window_start):
+        """下次心跳前的等待秒数"""
+        now = time.time()
+        delay = self.interval
+        issued_at = self._session.sid_issued_at
+        if self.lifetime is not None and issued_at is not None:
+            if self._converged():
+                # 寿命已估准：在预计过期前醒来重新登录
+                target = self._expiry() - REAUTH_MARGIN
+            else:
+                # 在上下界中点加测一次 getJrsqxx，收紧寿命估计
+                target = issued_at + (self.lifetime_lo + self.lifetime_hi) / 2
+            if target > now:
+                delay = min(delay, target - now)
+        # 窗口开始前最后检查一次，必要时在窗口前重新登录
+        delay = min(delay, max(window_start - REAUTH_MARGIN / 2 - now, 1))
+        return max(delay, 1)
+
+
+def start(session_config, windows):
+    """为学生启动心跳线程"""
+    return Heartbeat(session_config, windows).start()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   hedge.py
+# @Time    :   2025/08/29 16:38:05
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import asyncio
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from loguru import logger
+
+import metrics
+
+# 对冲请求：关键请求在阈值内未返回时，在另一条连接上发出相同的请求，取先成功的结果。
+# 阈值取该接口近期耗时的高分位数，样本不足时取所有 simso 接口的耗时，仍不足时取默认值。
+
+HEDGE_QUANTILE = 0.9
+HEDGE_MIN_SAMPLES = 10
+HEDGE_DEFAULT_DELAY = 0.25
+HEDGE_MIN_DELAY = 0.02
+HEDGE_MAX_DELAY = 1.0
+# 对冲预算：每个接口的对冲请求数不超过请求数的 HEDGE_BUDGET 倍再加 HEDGE_BURST，
+# 避免服务端整体变慢时对冲成倍放大负载
+HEDGE_BUDGET = 0.1
+HEDGE_BURST = 2
+# 每个接口保留的最近样本数
+MAX_SAMPLES = 500
+# 阈值缓存的样本间隔，避免每个请求都排序
+REFRESH_EVERY = 10
+
+ALL = "*"
+
+
+class LatencyTracker:
+    """按接口记录近期 simso 请求的耗时，给出对冲阈值"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples = {}
+        # 接口 -> (计算时的样本数, 阈值)
+        self._cache = {}
+        # 接口 -> [请求数, 对冲数]
+        self._counts = {}
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            for key in (phase, ALL):
+                self._samples.setdefault(key, deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+    def _quantile(self, key):
+        samples = self._samples.get(key)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        count, value = self._cache.get(key, (0, None))
+        if value is None or abs(len(samples) - count) >= REFRESH_EVERY or len(samples) == MAX_SAMPLES:
+            values = sorted(samples)
+            value = values[min(int(HEDGE_QUANTILE * len(values)), len(values) - 1)]
+            self._cache[key] = (len(samples), value)
+        return value
+
+    def admit(self, phase):
+        """记录一次可对冲的请求"""
+        with self._lock:
+            self._counts.setdefault(phase, [0, 0])[0] += 1
+
+    def allow_hedge(self, phase):
+        """预算内时记录一次对冲并返回 True"""
+        with self._lock:
+            counts = self._counts.setdefault(phase, [0, 0])
+            if counts[1] >= counts[0] * HEDGE_BUDGET + HEDGE_BURST:
+                return False
+            counts[1] += 1
+            return True
+
+    def threshold(self, phase):
+        with self._lock:
+            value = self._quantile(phase)
+            if value is None:
+                value = self._quantile(ALL)
+        if value is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(value, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+
+tracker = LatencyTracker()
+
+
+def _succeeded(json):
+    return bool(json.get("success"))
+
+
+def _report_late(on_extra, winner):
+    """落选请求晚到的成功结果交给 on_extra 处理（如核对重复的 sqxxid）"""
+
+    def callback(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        if on_extra and _succeeded(future.result()):
+            on_extra(winner, future.result())
+
+    return callback
+
+
+def run(executor, phase, call, on_extra=None):
+    """同步对冲：call 返回解析后的 simso json，返回先成功的结果
+
+    都失败时返回主请求的结果或抛出其异常。
+    """
+    delay = tracker.threshold(phase)
+    tracker.admit(phase)
+    primary = executor.submit(contextvars.copy_context().run, call)
+    done, _ = wait([primary], timeout=delay)
+    if done or not tracker.allow_hedge(phase):
+        return primary.result()
+
+    logger.debug(f"{phase} 超过 {delay * 1000:.0f} ms 未返回，发出对冲请求")
+    metrics.registry.observe(f"hedge_{phase}", delay)
+    futures = [primary, executor.submit(contextvars.copy_context().run, call)]
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = _pick(futures, pending)
+        if winner is not None:
+            _settle(futures, pending, winner, on_extra)
+            return winner.result()
+    return primary.result()
+
+
+async def run_async(phase, call, on_extra=None):
+    """run 的异步版本，call 为返回解析后 json 的协程函数"""
+    delay = tracker.threshold(phase)
+    tracker.admit(phase)
+    primary = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done or not tracker.allow_hedge(phase):
+        return await primary
+
+    logger.debug(f"{phase} 超过 {delay * 1000:.0f} ms 未返回，发出对冲请求")
+    metrics.registry.observe(f"hedge_{phase}", delay)
+    futures = [primary, asyncio.ensure_future(call())]
+    pending = set(futures)
+    while pending:
+        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        winner = _pick(futures, pending)
+        if winner is not None:
+            _settle(futures, pending, winner, on_extra)
+            return winner.result()
+    return primary.result()
+
+
+def _pick(futures, pending):
+    """已完成的请求中第一个成功的，主请求优先"""
+    for future in futures:
+        if future in pending or future.cancelled() or future.exception() is not None:
+            continue
+        if _succeeded(future.result()):
+            return future
+    return None
+
+
+def _settle(futures, pending, winner, on_extra):
+    """胜出后处理其余请求：已成功的立即核对，未返回的等返回后核对，不取消以免丢失服务端状态"""
+    for future in futures:
+        if future is winner:
+            continue
+        if future in pending:
+            future.add_done_callback(_report_late(on_extra, winner.result()))
+        else:
+            _report_late(on_extra, winner.result())(future)
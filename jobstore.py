@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   jobstore.py
+# @Time    :   2025/08/25 10:12:36
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+# 任务状态库路径
+DEFAULT_PATH = os.environ.get("PKU_JOB_STORE", "jobs.db")
+
+# 预约任务状态
+PENDING = "pending"
+WARMING = "warming"
+FIRED = "fired"
+DONE = "done"
+FAILED = "failed"
+
+# 被预约人状态
+SAVED = "saved"
+SUCCEEDED = "succeeded"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    tag TEXT PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    yyrq TEXT NOT NULL,
+    open_time TEXT NOT NULL,
+    state TEXT NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visitors (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    sqxxid TEXT,
+    message TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+"""
+
+
+class JobStore:
+    """基于 SQLite 的预约任务状态库，进程崩溃重启后据此恢复
+
+    每次状态变化立即提交；submitSqxx 成功的被预约人在重启后不会再次提交。
+    """
+
+    def __init__(self, path=DEFAULT_PATH) -> None:
+        self.path = path
+        # 多个预约线程共用一个连接，由锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _write(self, sql, args):
+        with self._lock, self._conn:
+            self._conn.execute(sql, args)
+
+    def _read(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def register(self, tag, student_id, yyrq, open_time):
+        """登记预约任务，已存在时保留原有状态，返回当前状态"""
+        self._write(
+            "INSERT OR IGNORE INTO jobs (tag, student_id, yyrq, open_time, state, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (tag, str(student_id), str(yyrq), open_time.isoformat(), PENDING, time.time()),
+        )
+        return self.job_state(tag)
+
+    def job_state(self, tag):
+        rows = self._read("SELECT state FROM jobs WHERE tag = ?", (tag,))
+        return rows[0][0] if rows else None
+
+    def set_job_state(self, tag, state, message=""):
+        self._write(
+            "UPDATE jobs SET state = ?, message = ?, updated_at = ? WHERE tag = ?",
+            (state, message, time.time(), tag),
+        )
+
+    def unfinished_students(self, tags):
+        """在 tags 中有未完成任务（待执行、预热中、已触发）的学号，即崩溃前仍在进行的学生"""
+        tags = list(tags)
+        if not tags:
+            return set()
+        rows = self._read(
+            "SELECT DISTINCT student_id FROM jobs WHERE state IN (?, ?, ?)"
+            f" AND tag IN ({', '.join('?' * len(tags))})",
+            (PENDING, WARMING, FIRED, *tags),
+        )
+        return {row[0] for row in rows}
+
+    def visitor(self, tag, key):
+        """返回被预约人的 (state, sqxxid)，未记录时返回 (None, None)"""
+        rows = self._read(
+            "SELECT state, sqxxid FROM visitors WHERE tag = ? AND key = ?", (tag, key)
+        )
+        return rows[0] if rows else (None, None)
+
+    def set_visitor(self, tag, key, name, state, sqxxid=None, message=""):
+        # sqxxid 为空时保留已记录的 sqxxid
+        self._write(
+            "INSERT INTO visitors (tag, key, name, state, sqxxid, message, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (tag, key) DO UPDATE SET state = excluded.state,"
+            " sqxxid = COALESCE(excluded.sqxxid, visitors.sqxxid),"
+            " message = excluded.message, updated_at = excluded.updated_at",
+            (tag, key, name, state, sqxxid, message, time.time()),
+        )
+
+    def succeeded(self, tag):
+        """已提交成功的被预约人 key"""
+        rows = self._read(
+            "SELECT key FROM visitors WHERE tag = ? AND state = ?", (tag, SUCCEEDED)
+        )
+        return {row[0] for row in rows}
+
+    def journal(self, tag):
+        return Journal(self, tag)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Journal:
+    """单个预约任务的状态记录，由会话在提交流程中调用"""
+
+    def __init__(self, store, tag) -> None:
+        self._store = store
+        self.tag = tag
+
+    def set_state(self, state, message=""):
+        self._store.set_job_state(self.tag, state, message)
+
+    def succeeded(self):
+        return self._store.succeeded(self.tag)
+
+    def sqxxid(self, key):
+        """此前已保存但尚未提交的 sqxxid，重启后直接复用，不再重复 saveSqxx"""
+        state, sqxxid = self._store.visitor(self.tag, key)
+        return sqxxid if state == SAVED else None
+
+    def saved(self, key, name, sqxxid):
+        self._store.set_visitor(self.tag, key, name, SAVED, sqxxid)
+
+    def finished(self, key, name, success, message=""):
+        self._store.set_visitor(
+            self.tag, key, name, SUCCEEDED if success else FAILED, message=message
+        )
+
+
+def open_store(path=DEFAULT_PATH):
+    """打开任务状态库，失败时返回 None（仅影响崩溃恢复，不影响预约）"""
+    started = time.perf_counter()
+    try:
+        store = JobStore(path)
+    except sqlite3.Error as e:
+        logger.warning(f"无法打开任务状态库 {path}: {e}")
+        return None
+    logger.debug(
+        f"任务状态库 {path} 已打开，耗时 {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return store
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   limiter.py
+# @Time    :   2025/08/28 15:12:36
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib import parse
+
+import metrics
+from codes import resolve_future
+
+# 进程内所有 Session / AsyncSession 共用的请求调度：按主机限制并发数与速率（令牌桶），
+# 排队时按阶段优先级放行，开放时刻的 submitSqxx 不会被迟到的重新登录或心跳挤占。
+
+# 优先级，数值越小越先放行
+SUBMIT, SAVE, STATUS, LOGIN, HEARTBEAT = range(5)
+
+PHASE_PRIORITY = {
+    "submitSqxx": SUBMIT,
+    # 发送验证码是提交的前置步骤
+    "sendEcyzCode": SUBMIT,
+    "saveSqxx": SAVE,
+    "checkSqrq": STATUS,
+    "getJrsqxx": STATUS,
+    "oauthlogin": LOGIN,
+    "ssoLogin": LOGIN,
+    "appSysRedir": LOGIN,
+    "simsoLogin": LOGIN,
+}
+
+# 各主机的并发上限、每秒令牌数与桶容量由顶层配置 limits 给出，None 为不限；
+# 未配置 limits 时不限流：固定的默认值与学生、被预约人数量无关，人数多时会让开放时刻的提交排队
+
+# 当前线程 / 协程的优先级覆盖，如心跳线程中的 getJrsqxx 按 HEARTBEAT 排队
+_priority = contextvars.ContextVar("limiter_priority", default=None)
+
+
+class HostGate:
+    """单个主机的并发上限 + 令牌桶，等待者按 (优先级, 到达顺序) 依次放行
+
+    线程在 Condition 上等待；协程在各自事件循环的 future 上等待，
+    释放时经 call_soon_threadsafe 唤醒，不占用线程池。
+    """
+
+    def __init__(self, concurrency=None, rate=None, burst=None) -> None:
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst or (max(rate, 1) if rate else None)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiting = []
+        self._seq = itertools.count()
+        # 正在等待的协程：[(事件循环, future)]
+        self._futures = []
+
+    def _refill(self):
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _available(self):
+        return (self.concurrency is None or self._active < self.concurrency) and (
+            self.rate is None or self._tokens >= 1
+        )
+
+    def _take(self):
+        self._active += 1
+        if self.rate is not None:
+            self._tokens -= 1
+
+    def _wake(self):
+        """唤醒所有等待的线程与协程，由它们各自检查是否轮到自己（需持有锁）"""
+        self._cond.notify_all()
+        for loop, future in self._futures:
+            loop.call_soon_threadsafe(resolve_future, future)
+        self._futures = []
+
+    def _grant(self, ticket):
+        """ticket 排在队首且有余量时占用名额，否则返回需等待的秒数（None 为等到释放）"""
+        self._refill()
+        if self._waiting[0] == ticket and self._available():
+            heapq.heappop(self._waiting)
+            self._take()
+            # 唤醒下一位排队者检查余量
+            self._wake()
+            return 0
+        # 缺令牌时等到下一个令牌生成，否则等待释放
+        if self.rate is not None and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return None
+
+    def try_acquire(self):
+        """无人排队且有余量时立即占用，不阻塞"""
+        with self._cond:
+            self._refill()
+            if self._waiting or not self._available():
+                return False
+            self._take()
+            return True
+
+    def acquire(self, priority):
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                timeout = self._grant(ticket)
+                if timeout == 0:
+                    return
+                self._cond.wait(timeout)
+
+    async def acquire_async(self, priority):
+        """acquire 的协程版本，等待期间不阻塞事件循环；被取消时退出队列"""
+        loop = asyncio.get_running_loop()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._cond:
+                    timeout = self._grant(ticket)
+                    if timeout == 0:
+                        return
+                    future = loop.create_future()
+                    self._futures.append((loop, future))
+                await asyncio.wait([future], timeout=timeout)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._wake()
+            raise
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._wake()
+
+
+class RequestLimiter:
+    def __init__(self, limits=None) -> None:
+        self._lock = threading.Lock()
+        self._gates = {}
+        self.configure(limits)
+
+    def configure(self, limits=None):
+        """设置各主机的限制，未列出的主机与未给出的字段不受限；已有的排队状态会被丢弃"""
+        gates = {host: HostGate(**(limit or {})) for host, limit in (limits or {}).items()}
+        with self._lock:
+            self._gates = gates
+
+    def _gate(self, url):
+        return self._gates.get(parse.urlparse(str(url)).hostname)
+
+    @staticmethod
+    def _phase(url):
+        path = parse.urlparse(str(url)).path.rstrip("/")
+        return path.rsplit("/", 1)[-1].removesuffix(".do") or "root"
+
+    def _priority(self, phase):
+        override = _priority.get()
+        if override is not None:
+            return override
+        return PHASE_PRIORITY.get(phase, HEARTBEAT)
+
+    @contextmanager
+    def slot(self, url):
+        """同步请求占用所属主机的一个名额，排队耗时记为 queue_<阶段>"""
+        gate = self._gate(url)
+        if gate is None:
+            yield
+            return
+        phase = self._phase(url)
+        started = time.perf_counter()
+        if not gate.try_acquire():
+            gate.acquire(self._priority(phase))
+        metrics.registry.observe(f"queue_{phase}", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    @asynccontextmanager
+    async def slot_async(self, url):
+        """异步请求占用名额：有余量时直接占用，否则在事件循环中排队"""
+        gate = self._gate(url)
+        if gate is None:
+            yield
+            return
+        phase = self._phase(url)
+        started = time.perf_counter()
+        if not gate.try_acquire():
+            await gate.acquire_async(self._priority(phase))
+        metrics.registry.observe(f"queue_{phase}", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            gate.release()
+
+
+limiter = RequestLimiter()
+
+
+@contextmanager
+def background():
+    """上下文中的请求按最低优先级排队，用于心跳等后台任务"""
+    token = _priority.set(HEARTBEAT)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def configure(limits=None):
+    limiter.configure(limits)
+
+
+def slot(url):
+    return limiter.slot(url)
+
+
+def slot_async(url):
+    return limiter.slot_async(url)
@@ -8,22 +8,41 @@
 
 
 import argparse
+import asyncio
+import atexit
+import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import yaml
-import schedule
-from rich.console import Console
 from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn
 from rich.table import Table
 from rich.text import Text
 from loguru import logger
 
-from session import BarkNotifier, Session
+import codes
+import heartbeat
+import jobstore
+import limiter
+import metrics
+import prewarm
+import watcher
+from quiet import DeferredConsole
+from retry import DEFAULT_RETRY_INTERVAL, DEFAULT_RETRY_WINDOW, BurstRetry
+from scheduler import FiringScheduler, current_job, sleep_until
+from session import BarkNotifier, Session, visitor_key
 
-# 配置rich控制台
-console = Console()
+# 配置rich控制台，开放时刻前后的输出延后到提交结束再渲染
+console = DeferredConsole()
+
+# 高精度触发调度器
+scheduler = FiringScheduler()
+
+# 任务状态库，进程崩溃重启后据此恢复；配置 job_store: false 时为 None
+store = None
 
 # 配置loguru日志
 logger.remove()  # 移除默认处理器
@@ -32,9 +51,62 @@ logger.add(
     rotation="1 day",
     retention="7 days",
     level="DEBUG",
+    # 格式化仍在调用线程完成，格式化后的记录经管道交给后台线程，由其写入文件并检查轮转；
+    # 发起请求的线程省去的是文件写入与轮转检查
+    enqueue=True,
     format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
 )
 
+# 默认提前预热登录的秒数
+DEFAULT_WARMUP = 60
+# 开放前复查 sid 有效性的提前秒数
+SID_RECHECK_LEAD = 5
+# 默认同时提交的被预约人数量，1 表示串行提交
+DEFAULT_CONCURRENCY = 1
+# 预热时采样服务器时钟的默认次数，0 表示不校正时钟
+DEFAULT_CLOCK_SAMPLES = 5
+# 同时验证登录的学生数量
+LOGIN_TEST_WORKERS = 8
+
+# 可在顶层统一设置、并可在每个学生中单独覆盖的配置项及其默认值
+STUDENT_DEFAULTS = {
+    "bark": None,
+    "auto": None,
+    "totp_mode": "shortcut",
+    "totp_secret": None,
+    "warmup": DEFAULT_WARMUP,
+    "concurrency": DEFAULT_CONCURRENCY,
+    "sid_ttl": None,
+    "clock_samples": DEFAULT_CLOCK_SAMPLES,
+    "backend": "requests",
+    "session_cache": True,
+    "retry_window": DEFAULT_RETRY_WINDOW,
+    "retry_interval": DEFAULT_RETRY_INTERVAL,
+    "hosts": None,
+    "pipeline": True,
+    "heartbeat": True,
+    "hedge": False,
+    "http2": False,
+}
+
+# 所有预约任务的执行结果：(学号, 日期, 是否成功, 说明)
+reservation_results = []
+
+# 已调度的任务：tag -> 配置指纹，热重载时据此找出新增、修改与删除的任务
+live_jobs = {}
+
+# 各学生的 sid 心跳：学号 -> Heartbeat
+heartbeats = {}
+
+# 已通过登录测试（或从任务状态库恢复）的学号，热重载时其余学生需先测试登录
+admitted = set()
+
+# 当前生效的 limits 配置
+current_limits = None
+
+# 被预约人此前都已提交成功、因而未调度的任务，配置中新增被预约人后重新调度
+finished_jobs = set()
+
 
 def load_config(config_file):
     """加载配置文件"""
@@ -42,59 +114,295 @@ def load_config(config_file):
         return yaml.safe_load(f)
 
 
-def make_reservation(appointment_config, student_config):
-    """执行单个预约任务"""
-    date = appointment_config["yyrq"]
-    student_id = student_config["username"]
-    task_tag = f"appointment_{student_id}_{appointment_config['yyrq']}"
+def get_students(data):
+    """解析学生列表，兼容顶层只有一个学生的旧配置格式
+
+    顶层的全局配置作为默认值，每个学生可单独覆盖。
+    """
+    students = data.get("students")
+    if students is None:
+        students = [data]
 
-    # 检查是否到了预约开放时间
-    target_day = datetime.strptime(str(appointment_config["yyrq"]), "%Y%m%d")
-    open_time = (target_day - timedelta(days=3)).replace(
+    result = []
+    for student in students:
+        student_config = {
+            key: student.get(key, data.get(key, default))
+            for key, default in STUDENT_DEFAULTS.items()
+        }
+        for key in ("username", "password", "phone", "appointments"):
+            student_config[key] = student.get(key)
+        result.append(student_config)
+    return result
+
+
+def get_open_time(yyrq):
+    """计算预约开放时间（预约日期前3天的08:00:01）"""
+    target_day = datetime.strptime(str(yyrq), "%Y%m%d")
+    return (target_day - timedelta(days=3)).replace(
         hour=8, minute=0, second=1, microsecond=0
     )
-    current_time = datetime.now()
 
-    if current_time < open_time:
-        return
 
-    logger.info(f"开始执行预约 - 学生: {student_id}, 日期: {date}")
-    console.print(f"[bold blue]🔄 正在为学生 {student_id} 执行预约任务...[/bold blue]")
+def get_warmup_time(yyrq, student_config):
+    """计算预热登录时间（开放时间前 warmup 秒）"""
+    lead = student_config.get("warmup", DEFAULT_WARMUP)
+    return get_open_time(yyrq) - timedelta(seconds=lead)
 
-    # 创建通知器
-    bark_token = student_config.get("bark", None)
-    notifier = BarkNotifier(bark_token)
 
-    # 合并配置信息
+def group_appointments(student_config):
+    """按开放时间分组学生的预约，同一组共用一个登录会话，按开放时间排序"""
+    groups = {}
+    for appointment in student_config["appointments"]:
+        groups.setdefault(get_open_time(appointment["yyrq"]), []).append(appointment)
+    return [groups[open_time] for open_time in sorted(groups)]
+
+
+def build_session_config(appointments, student_config):
+    """合并学生配置与同一开放时间的预约，生成 Session 所需的配置"""
     session_config = {
-        "username": student_config["username"],
-        "password": student_config["password"],
-        "phone": student_config["phone"],
-        "yyrq": appointment_config["yyrq"],
-        "yyxm": appointment_config["yyxm"],
-        "yysj": appointment_config["yysj"],
-        "yysy": appointment_config["yysy"],
-        "mode": appointment_config["mode"],
-        "auto": student_config["auto"],
-        "appointments": appointment_config["visitors"],
+        key: value for key, value in student_config.items() if key != "appointments"
     }
+    session_config["appointments"] = appointments
+    return session_config
+
+
+def job_tag(student_id, date):
+    return f"appointment_{student_id}_{date}"
+
+
+def all_succeeded(appointments, tag):
+    """任务中的被预约人是否此前都已提交成功（依据任务状态库）"""
+    if not store:
+        return False
+    succeeded = store.succeeded(tag)
+    keys = [
+        visitor_key(appointment, visitor["id"])
+        for appointment in appointments
+        for visitor in appointment.get("visitors", [])
+    ]
+    return bool(keys) and all(key in succeeded for key in keys)
+
+
+def has_pending(student_config):
+    """学生是否还有尚未全部成功的任务"""
+    return not all(
+        all_succeeded(appointments, job_tag(student_config["username"], appointments[0]["yyrq"]))
+        for appointments in group_appointments(student_config)
+    )
+
+
+def job_fingerprint(appointments, student_config):
+    """任务的配置指纹，学生配置或任一预约变化时随之变化"""
+    return json.dumps(
+        build_session_config(appointments, student_config),
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+def create_session(session_config, notifier):
+    """按配置的 backend 创建会话：requests（同步，默认）或 httpx（异步）"""
+    backend = session_config.get("backend", "requests")
+    # requests 只支持 HTTP/1.1，HTTP/2 需使用 httpx 后端
+    if session_config.get("http2") and backend == "requests":
+        logger.info(f"学生 {session_config['username']} 开启了 http2，使用 httpx 后端")
+        backend = "httpx"
+    if backend == "httpx":
+        from async_session import AsyncSession
+
+        return AsyncSession(config=session_config, notifier=notifier)
+    if backend != "requests":
+        raise ValueError(f"未知的 backend: {backend}")
+    return Session(config=session_config, notifier=notifier)
+
+
+def warm_up(session, open_time, clock_samples=DEFAULT_CLOCK_SAMPLES):
+    """预热：提前完成登录，并在开放前复查 sid 是否仍然有效
+
+    返回按服务器时钟换算的本地触发时刻，此时 session 已处于可直接提交的状态，
+    开放时刻只需发送 checkSqrq / saveSqxx / submitSqxx 请求；登录失败返回 None。
+    """
+    session.warm_connections()
+    if not session.ensure_login():
+        return None
+
+    # 采样服务器时钟，开放时刻按服务器时钟触发
+    if clock_samples:
+        session.sync_clock(clock_samples)
+
+    # 保活截止与 sid 复查都以按服务器时钟换算的触发时刻为准
+    fire_time = get_fire_time(session, open_time, clock_samples)
+
+    # 保活连接直到开放前，开放时刻无需重新握手
+    session.start_keep_warm(fire_time - timedelta(seconds=prewarm.KEEPALIVE_GUARD))
+
+    # 开放前再复查一次 sid，失效则重新登录
+    sleep_until(fire_time - timedelta(seconds=SID_RECHECK_LEAD))
+    if not session.login_check():
+        logger.warning("预热后 sid 已失效，重新登录")
+        if not session.ensure_login(force=True):
+            return None
+
+    # 构造开放时刻的 checkSqrq / saveSqxx 请求，开放时刻只需发送
+    session.prepare()
+    log_fire_time(session, fire_time)
+    return fire_time
+
+
+async def warm_up_async(session, open_time, clock_samples=DEFAULT_CLOCK_SAMPLES):
+    """warm_up 的异步版本，用于 httpx 后端"""
+    await session.warm_connections()
+    if not await session.ensure_login():
+        return None
+
+    # 采样服务器时钟，开放时刻按服务器时钟触发
+    if clock_samples:
+        await session.sync_clock(clock_samples)
+
+    # 保活截止与 sid 复查都以按服务器时钟换算的触发时刻为准
+    fire_time = get_fire_time(session, open_time, clock_samples)
+
+    # 保活连接直到开放前，开放时刻无需重新握手
+    session.start_keep_warm(fire_time - timedelta(seconds=prewarm.KEEPALIVE_GUARD))
+
+    # 开放前再复查一次 sid，失效则重新登录
+    await asyncio.to_thread(
+        sleep_until, fire_time - timedelta(seconds=SID_RECHECK_LEAD)
+    )
+    if not await session.login_check():
+        logger.warning("预热后 sid 已失效，重新登录")
+        if not await session.ensure_login(force=True):
+            return None
 
-    s = Session(config=session_config, notifier=notifier)
+    # 构造开放时刻的 checkSqrq / saveSqxx 请求，开放时刻只需发送
+    session.prepare()
+    log_fire_time(session, fire_time)
+    return fire_time
+
+
+def get_fire_time(session, open_time, clock_samples):
+    """开放时间以服务器时钟为准，换算为本地时刻"""
+    return session.clock.to_local(open_time) if clock_samples else open_time
+
+
+def log_fire_time(session, fire_time):
+    logger.info(
+        f"学生 {session._config['username']} 预热完成，将在本地时刻 {fire_time} 提交"
+    )
+
+
+def arm_retry(session, fire_time):
+    """开放后 retry_window 秒内，对尚未开放、5xx 等暂时性失败进行突发重试"""
+    window = session._config.get("retry_window", DEFAULT_RETRY_WINDOW)
+    if window:
+        session.retry = BurstRetry(
+            fire_time + timedelta(seconds=window),
+            interval=session._config.get("retry_interval", DEFAULT_RETRY_INTERVAL),
+        )
+
+
+def log_retry(session):
+    if session.retry and session.retry.attempts:
+        logger.info(
+            f"学生 {session._config['username']} 重试统计: {session.retry.summary()}"
+        )
+
+
+def reserve(session, open_time, clock_samples):
+    """预热并在开放时刻提交，返回 (每位被预约人的结果, 触发偏差)，登录失败返回 (None, None)"""
+    with session:
+        fire_time = warm_up(session, open_time, clock_samples)
+        if fire_time is None:
+            return None, None
+
+        # 从开放前数秒到提交结束为静默窗口，rich 输出延后渲染
+        with console.hold():
+            arm_retry(session, fire_time)
+            jitter = sleep_until(fire_time)
+            logger.info(f"开始提交预约，触发偏差 {jitter * 1000:.3f} ms")
+            if session.journal:
+                session.journal.set_state(jobstore.FIRED)
+            try:
+                return session.submit_all(), jitter
+            finally:
+                log_retry(session)
+
+
+async def reserve_async(session, open_time, clock_samples):
+    """reserve 的异步版本，用于 httpx 后端"""
+    async with session:
+        fire_time = await warm_up_async(session, open_time, clock_samples)
+        if fire_time is None:
+            return None, None
+
+        # 从开放前数秒到提交结束为静默窗口，rich 输出延后渲染
+        with console.hold():
+            arm_retry(session, fire_time)
+            jitter = await asyncio.to_thread(sleep_until, fire_time)
+            logger.info(f"开始提交预约，触发偏差 {jitter * 1000:.3f} ms")
+            if session.journal:
+                session.journal.set_state(jobstore.FIRED)
+            try:
+                return await session.submit_all(), jitter
+            finally:
+                log_retry(session)
+
+
+def make_reservation(appointments, student_config, tag):
+    """执行同一学生、同一开放时间的预约任务，所有预约共用一个登录会话"""
+    date = appointments[0]["yyrq"]
+    student_id = student_config["username"]
+    open_time = get_open_time(date)
+
+    logger.info(f"开始预热登录 - 学生: {student_id}, 日期: {date}")
+    console.print(f"[bold blue]🔄 正在为学生 {student_id} 预热登录...[/bold blue]")
+
+    # 创建通知器
+    bark_token = student_config.get("bark", None)
+    notifier = BarkNotifier(bark_token)
+
+    session_config = build_session_config(appointments, student_config)
+    clock_samples = student_config.get("clock_samples", DEFAULT_CLOCK_SAMPLES)
+    journal = store.journal(tag) if store else None
 
     try:
-        if not s.login():
+        s = create_session(session_config, notifier)
+        s.journal = journal
+        if journal:
+            journal.set_state(jobstore.WARMING)
+        # 登录、预热阶段的请求同样带上学生与日期标签
+        with metrics.labels(student=student_id, date=date):
+            if isinstance(s, Session):
+                results, jitter = reserve(s, open_time, clock_samples)
+            else:
+                results, jitter = asyncio.run(reserve_async(s, open_time, clock_samples))
+        job = current_job()
+        if job:
+            job.fire_jitter = jitter
+
+        if results is None:
             error_msg = "验证登录失败，请检查配置"
             logger.error(f"学生 {student_id}: {error_msg}")
             console.print(f"[bold red]✗ 学生 {student_id}: {error_msg}[/bold red]")
             if notifier.valid:
                 notifier.send(f"Student {student_id}: {error_msg}")
-            # 移除失败的调度任务
-            schedule.clear(task_tag)
-            logger.info(f"已移除失败任务的调度: {task_tag}")
+            record_result(journal, student_id, date, False, error_msg)
             return
 
-        logger.info(f"学生 {student_id} 登录成功，开始提交预约")
-        s.submit_all()
+        print_visitor_results(student_id, date, results)
+
+        failed = [f"{name}: {msg}" for name, success, msg in results if not success]
+        if failed:
+            error_msg = f"部分预约失败（{len(failed)}/{len(results)}）- {'; '.join(failed)}"
+            logger.error(f"学生 {student_id}: {error_msg}")
+            console.print(f"[bold red]✗ 学生 {student_id} ({date}): {error_msg}[/bold red]")
+            if notifier.valid:
+                notifier.send(
+                    f"Student {student_id}: {len(results) - len(failed)}/{len(results)} Succeed"
+                )
+            record_result(journal, student_id, date, False, error_msg)
+            return
 
         success_msg = "所有预约提交成功"
         logger.success(f"学生 {student_id}: {success_msg}")
@@ -104,10 +412,7 @@ def make_reservation(appointment_config, student_config):
 
         if notifier.valid:
             notifier.send(f"Student {student_id}: All Succeed")
-
-        # 预约成功后移除调度任务
-        schedule.clear(task_tag)
-        logger.info(f"预约完成，已移除调度: {task_tag}")
+        record_result(journal, student_id, date, True, success_msg)
 
     except AssertionError as e:
         error_msg = f"预约失败 - {str(e)}"
@@ -115,32 +420,62 @@ def make_reservation(appointment_config, student_config):
         console.print(f"[bold red]✗ 学生 {student_id} ({date}): {error_msg}[/bold red]")
         if notifier.valid:
             notifier.send(f"Student {student_id}: Failed - {e}")
-        # 移除失败的调度任务
-        schedule.clear(task_tag)
-        logger.info(f"已移除失败任务的调度: {task_tag}")
+        record_result(journal, student_id, date, False, error_msg)
     except Exception as e:
         error_msg = f"意外错误 - {str(e)}"
         logger.error(f"学生 {student_id}: {error_msg}")
         console.print(f"[bold red]✗ 学生 {student_id} ({date}): {error_msg}[/bold red]")
         if notifier.valid:
             notifier.send(f"Student {student_id}: Error - {e}")
-        # 移除失败的调度任务
-        schedule.clear(task_tag)
-        logger.info(f"已移除失败任务的调度: {task_tag}")
+        record_result(journal, student_id, date, False, error_msg)
+
+
+def record_result(journal, student_id, date, success, message):
+    """记录任务结果，并写入任务状态库"""
+    reservation_results.append((student_id, date, success, message))
+    if journal:
+        journal.set_state(jobstore.DONE if success else jobstore.FAILED, message)
 
 
-def schedule_appointment(appointment_config, student_config):
-    """为单个预约安排调度"""
+def print_visitor_results(student_id, date, results):
+    """显示每位被预约人的提交结果"""
+    result_table = Table()
+    result_table.add_column("被预约人", style="cyan")
+    result_table.add_column("状态", style="bold")
+    result_table.add_column("说明")
+
+    for name, success, message in results:
+        status = "[green]✓ 成功[/green]" if success else "[red]✗ 失败[/red]"
+        result_table.add_row(name, status, message)
+        logger.info(f"学生 {student_id} ({date}) - {name}: {message}")
+
+    console.print(
+        Panel(result_table, title=f"[bold blue]📋 {student_id} ({date}) 提交结果[/bold blue]")
+    )
+
+
+def schedule_appointments(appointments, student_config):
+    """为同一学生、同一开放时间的预约安排调度"""
     student_id = student_config["username"]
-    target_day = datetime.strptime(str(appointment_config["yyrq"]), "%Y%m%d")
+    date = appointments[0]["yyrq"]
+    target_day = datetime.strptime(str(date), "%Y%m%d")
     now = datetime.now()
 
-    # 计算到预约开放时间的差值（预约日期前3天的08:00:01）
-    open_time = (target_day - timedelta(days=3)).replace(
-        hour=8, minute=0, second=1, microsecond=0
-    )
+    # 计算到预热时间的差值（开放时间为预约日期前3天的08:00:01）
+    open_time = get_open_time(date)
+    warmup_time = get_warmup_time(date, student_config)
+    tag = job_tag(student_id, date)
+
+    # 崩溃重启后，被预约人都已提交成功的任务不再执行（不登录、不通知）；
+    # 其余任务照常调度，已提交成功的被预约人按任务状态库逐个跳过
+    state = store.register(tag, student_id, date, open_time) if store else None
+    if all_succeeded(appointments, tag):
+        logger.info(f"学生 {student_id} ({date}) 的被预约人此前已全部提交成功，跳过")
+        reservation_results.append((student_id, date, True, "此前已全部成功"))
+        finished_jobs.add(tag)
+        return
 
-    time_diff = (open_time - now).total_seconds()
+    time_diff = (warmup_time - now).total_seconds()
 
     # 显示调度信息
     schedule_table = Table(show_header=False, box=None, padding=(0, 1))
@@ -148,7 +483,17 @@ def schedule_appointment(appointment_config, student_config):
     schedule_table.add_column("值", style="white")
     schedule_table.add_row("学生ID", str(student_id))
     schedule_table.add_row("预约日期", target_day.strftime("%Y-%m-%d"))
+    schedule_table.add_row(
+        "预约",
+        ", ".join(
+            f"{appointment['mode']} {appointment['yyxm']} {appointment['yysj']}"
+            for appointment in appointments
+        ),
+    )
     schedule_table.add_row("开放时间", open_time.strftime("%Y-%m-%d %H:%M:%S"))
+    schedule_table.add_row("预热时间", warmup_time.strftime("%Y-%m-%d %H:%M:%S"))
+    if state not in (None, jobstore.PENDING):
+        schedule_table.add_row("恢复状态", state)
 
     # 创建通知器用于调度通知
     bark_token = student_config.get("bark", None)
@@ -173,32 +518,225 @@ def schedule_appointment(appointment_config, student_config):
                 f"Student {student_id}: 已安排自动预约任务，将在 {open_time.strftime('%Y-%m-%d %H:%M:%S')} 开始"
             )
 
-        # 使用schedule安排任务
-        schedule.every().day.at(open_time.strftime("%H:%M:%S")).do(
-            make_reservation, appointment_config, student_config
-        ).tag(f"appointment_{student_id}_{appointment_config['yyrq']}")
+        # 在预热时间触发，登录后等待开放时间提交
+        scheduler.add(
+            warmup_time,
+            make_reservation,
+            appointments,
+            student_config,
+            tag,
+            tag=tag,
+        )
 
     else:
-        # 预约时间已过或不足3天，立即执行
-        schedule_table.add_row("状态", "[green]立即执行[/green]")
-        console.print(
-            Panel(schedule_table, title="[bold green]⚡ 立即执行[/bold green]")
+        if open_time > now:
+            # 已进入预热窗口但尚未开放，立即开始预热，开放时刻提交
+            schedule_table.add_row("状态", "[green]立即预热[/green]")
+            console.print(
+                Panel(schedule_table, title="[bold green]⚡ 立即预热[/bold green]")
+            )
+            logger.info(
+                f"学生 {student_id} - 已进入预热窗口，立即开始预热，将在 {open_time.strftime('%Y-%m-%d %H:%M:%S')} 提交"
+            )
+            if notifier.valid:
+                notifier.send(
+                    f"Student {student_id}: 立即开始预热，将在 {open_time.strftime('%Y-%m-%d %H:%M:%S')} 提交"
+                )
+        else:
+            # 预约时间已过或不足3天，立即执行
+            schedule_table.add_row("状态", "[green]立即执行[/green]")
+            console.print(
+                Panel(schedule_table, title="[bold green]⚡ 立即执行[/bold green]")
+            )
+            logger.info(f"学生 {student_id} - 预约时间已过或不足3天，立即执行")
+            if notifier.valid:
+                notifier.send(f"Student {student_id}: 立即开始预约")
+
+        # 立即执行的任务同样交给调度器，在独立线程中运行，不阻塞其它学生
+        scheduler.add(
+            now,
+            make_reservation,
+            appointments,
+            student_config,
+            tag,
+            tag=tag,
         )
-        logger.info(f"学生 {student_id} - 预约时间已过或不足3天，立即执行")
 
-        if notifier.valid:
-            notifier.send(f"Student {student_id}: 立即开始预约")
 
-        # 为立即执行的任务也添加相同的清理逻辑
-        make_reservation(appointment_config, student_config)
+def schedule_students(students):
+    """为所有学生的预约安排调度，并记录各任务的配置指纹"""
+    for student_config in students:
+        for appointments in group_appointments(student_config):
+            schedule_appointments(appointments, student_config)
+            tag = job_tag(student_config["username"], appointments[0]["yyrq"])
+            live_jobs[tag] = job_fingerprint(appointments, student_config)
+    update_heartbeats(students)
+
+
+def start_heartbeat(student_config, windows):
+    """学生有定时任务时在后台保持会话缓存中的 sid 有效，预热时直接复用"""
+    if not windows or not student_config["heartbeat"] or not student_config["session_cache"]:
+        return None
+    logger.info(f"学生 {student_config['username']} 启动 sid 心跳，覆盖 {len(windows)} 个预约窗口")
+    return heartbeat.start(build_session_config([], student_config), windows)
+
+
+def update_heartbeats(students):
+    """按尚未触发的定时任务更新各学生的心跳窗口，学生配置变化时重启心跳"""
+    now = datetime.now()
+    windows = {}
+    for job in scheduler.jobs:
+        appointments, student_config, _ = job.args
+        if job.when > now:
+            windows.setdefault(student_config["username"], []).append(
+                (job.when, get_open_time(appointments[0]["yyrq"]))
+            )
+
+    student_ids = set()
+    for student_config in students:
+        student_id = student_config["username"]
+        student_ids.add(student_id)
+        current = heartbeats.get(student_id)
+        if (
+            current
+            and current.alive
+            and current.config == build_session_config([], student_config)
+        ):
+            current.set_windows(windows.get(student_id, []))
+            continue
+        if current:
+            current.stop()
+        heartbeats[student_id] = start_heartbeat(student_config, windows.get(student_id, []))
+
+    for student_id in set(heartbeats) - student_ids:
+        current = heartbeats.pop(student_id)
+        if current:
+            current.stop()
+
+
+def configure_limits(limits):
+    """limits 变化时才重新配置：重新配置会替换所有主机的令牌桶并清零在途计数"""
+    global current_limits
+    if limits == current_limits:
+        return
+    limiter.configure(limits)
+    current_limits = limits
+
+
+def admit_students(students):
+    """尚未通过登录测试的学生（新增的，或启动时登录失败的）先测试登录，返回可调度的学生
+
+    任务此前都已全部成功的学生无需登录，照常返回，其任务在调度时跳过。
+    """
+    pending = [student for student in students if has_pending(student)]
+    untested = [student for student in pending if str(student["username"]) not in admitted]
+    if untested:
+        admitted.update(str(student["username"]) for student in test_logins(untested))
+    return [
+        student
+        for student in students
+        if student not in pending or str(student["username"]) in admitted
+    ]
+
+
+def reload_config(config_file):
+    """配置文件变化后增量调度：只安排新增或修改的任务，取消删除的任务
+
+    未变化的任务保持原样，已预热的会话与连接不受影响；只有尚未通过登录测试的学生
+    会重新测试登录。已开始预热的任务无法修改或取消。
+    """
+    started = time.perf_counter()
+    data = load_config(config_file)
+    students = get_students(data)
+    validate_config(students)
+    configure_limits(data.get("limits"))
+    console.enabled = data.get("quiet_window", True)
+    students = admit_students(students)
+
+    desired = {}
+    for student_config in students:
+        for appointments in group_appointments(student_config):
+            tag = job_tag(student_config["username"], appointments[0]["yyrq"])
+            desired[tag] = (appointments, student_config)
+
+    pending = {job.tag for job in scheduler.jobs}
+    added, changed, removed = [], [], []
+    for tag in set(live_jobs) - set(desired):
+        if tag in pending:
+            scheduler.cancel(tag)
+            removed.append(tag)
+        elif tag in finished_jobs:
+            finished_jobs.discard(tag)
+        else:
+            logger.warning(f"任务 {tag} 已开始执行，无法取消")
+        del live_jobs[tag]
+
+    for tag, (appointments, student_config) in desired.items():
+        fingerprint = job_fingerprint(appointments, student_config)
+        previous = live_jobs.get(tag)
+        if previous == fingerprint:
+            continue
+        if previous is not None:
+            if tag in finished_jobs:
+                # 此前已全部成功的任务：新增了被预约人时重新调度
+                finished_jobs.discard(tag)
+            elif tag not in pending:
+                logger.warning(f"任务 {tag} 已开始执行，本次修改不生效")
+                continue
+            else:
+                scheduler.cancel(tag)
+            changed.append(tag)
+        else:
+            added.append(tag)
+        schedule_appointments(appointments, student_config)
+        live_jobs[tag] = fingerprint
+
+    update_heartbeats(students)
+    elapsed = (time.perf_counter() - started) * 1000
+    console.print(
+        f"[bold blue]🔁 配置已重新加载：新增 {len(added)}、修改 {len(changed)}、"
+        f"取消 {len(removed)} 个任务，耗时 {elapsed:.1f} ms[/bold blue]"
+    )
+    logger.info(
+        f"配置已重新加载 - 新增 {added}，修改 {changed}，取消 {removed}，耗时 {elapsed:.1f} ms"
+    )
 
 
-def validate_config(data):
+def start_sms_server(server_config):
+    """在本进程内启动短信验证码接收服务，验证码经进程内队列直接交给等待方"""
+    import uvicorn
+
+    import server
+
+    server.configure(server_config.get("token"))
+    codes.broker.attached = True
+    sms_server = uvicorn.Server(
+        uvicorn.Config(
+            server.app,
+            host=server_config.get("host", "0.0.0.0"),
+            port=server_config.get("port", 8000),
+            log_level="warning",
+        )
+    )
+    threading.Thread(target=sms_server.run, name="sms_server", daemon=True).start()
+    logger.info(
+        f"短信验证码接收服务已在本进程内启动: "
+        f"{server_config.get('host', '0.0.0.0')}:{server_config.get('port', 8000)}"
+    )
+
+
+def validate_config(students):
     """验证配置文件格式"""
-    if "appointments" not in data or "username" not in data or "password" not in data:
-        raise ValueError("配置文件缺少必要的字段: appointments, username, password")
+    for i, student in enumerate(students, start=1):
+        missing = [
+            key
+            for key in ("username", "password", "phone", "auto", "appointments")
+            if student.get(key) is None
+        ]
+        if missing:
+            raise ValueError(f"第 {i} 个学生的配置缺少必要的字段: {', '.join(missing)}")
 
-    appointments = data["appointments"]
+    appointment_count = sum(len(student["appointments"]) for student in students)
 
     # 创建验证结果表格
     validation_table = Table()
@@ -206,59 +744,68 @@ def validate_config(data):
     validation_table.add_column("数量", style="magenta")
     validation_table.add_column("状态", style="green")
 
-    validation_table.add_row("学生", "1", "✓ 验证成功")
-    validation_table.add_row("预约", str(len(appointments)), "✓ 验证成功")
+    validation_table.add_row("学生", str(len(students)), "✓ 验证成功")
+    validation_table.add_row("预约", str(appointment_count), "✓ 验证成功")
 
     console.print(
         Panel(validation_table, title="[bold green]✓ 配置验证结果[/bold green]")
     )
-    logger.info(f"配置验证成功 - 1 个学生, {len(appointments)} 个预约")
+    logger.info(f"配置验证成功 - {len(students)} 个学生, {appointment_count} 个预约")
 
 
-def test_logins(data):
-    """测试学生的登录配置"""
-    console.print("[bold blue]🔍 正在验证学生的登录配置...[/bold blue]")
+def test_login(student_config):
+    """测试单个学生的登录配置，返回 (学号, 是否成功, 说明)"""
+    student_id = student_config["username"]
+
+    # 创建临时配置用于测试
+    test_appointment = {
+        "yyrq": "20240101",  # 临时日期
+        "yyxm": "东南门",
+        "yysj": "10:00",
+        "yysy": "测试",
+        "mode": "燕园",
+        "visitors": [],
+    }
+    test_config = build_session_config([test_appointment], student_config)
 
-    login_results = []
-    student_id = data["username"]
+    notifier = BarkNotifier(student_config["bark"])
+
+    try:
+        s = create_session(test_config, notifier)
+        # 登录结果写入会话缓存，预约任务预热时直接复用，无需再次登录
+        if isinstance(s, Session):
+            success = s.ensure_login()
+        else:
+            success = asyncio.run(login_async(s))
+
+        if not success:
+            logger.error(f"学生 {student_id} 登录失败")
+            return (student_id, False, "登录失败，请检查用户名和密码")
+        logger.success(f"学生 {student_id} 登录成功")
+        return (student_id, True, "登录验证成功")
+    except Exception as e:
+        logger.error(f"学生 {student_id} 遇到错误: {e}")
+        return (student_id, False, f"错误: {str(e)}")
+
+
+async def login_async(session):
+    async with session:
+        return await session.ensure_login()
+
+
+def test_logins(students):
+    """并发测试所有学生的登录配置，返回登录成功的学生"""
+    console.print("[bold blue]🔍 正在验证学生的登录配置...[/bold blue]")
 
     with Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         console=console,
     ) as progress:
-        task = progress.add_task(f"验证学生 {student_id}...", total=None)
-
-        # 创建临时配置用于测试
-        test_config = {
-            "username": data["username"],
-            "password": data["password"],
-            "phone": data["phone"],
-            "yyrq": "20240101",  # 临时日期
-            "yyxm": "东南门",
-            "yysj": "10:00",
-            "yysy": "测试",
-            "mode": "燕园",
-            "auto": data["auto"],
-            "appointments": [],
-        }
-
-        bark_token = data.get("bark", None)
-        notifier = BarkNotifier(bark_token)
-        s = Session(config=test_config, notifier=notifier)
+        task = progress.add_task(f"验证 {len(students)} 个学生...", total=None)
 
-        try:
-            if not s.login():
-                login_results.append(
-                    (student_id, False, "登录失败，请检查用户名和密码")
-                )
-                logger.error(f"学生 {student_id} 登录失败")
-            else:
-                login_results.append((student_id, True, "登录验证成功"))
-                logger.success(f"学生 {student_id} 登录成功")
-        except Exception as e:
-            login_results.append((student_id, False, f"错误: {str(e)}"))
-            logger.error(f"学生 {student_id} 遇到错误: {e}")
+        with ThreadPoolExecutor(max_workers=LOGIN_TEST_WORKERS) as executor:
+            login_results = list(executor.map(test_login, students))
 
         progress.remove_task(task)
 
@@ -284,7 +831,35 @@ def test_logins(data):
         )
     )
 
-    return all_success
+    return [
+        student
+        for student, (_, success, _) in zip(students, login_results)
+        if success
+    ]
+
+
+def print_summary():
+    """汇总显示所有学生的预约结果"""
+    summary_table = Table()
+    summary_table.add_column("学生ID", style="cyan")
+    summary_table.add_column("预约日期", style="white")
+    summary_table.add_column("状态", style="bold")
+    summary_table.add_column("说明")
+
+    for student_id, date, success, message in sorted(
+        reservation_results, key=lambda result: (str(result[0]), str(result[1]))
+    ):
+        status = "[green]✓ 成功[/green]" if success else "[red]✗ 失败[/red]"
+        summary_table.add_row(str(student_id), str(date), status, message)
+
+    succeeded = sum(1 for result in reservation_results if result[2])
+    console.print(
+        Panel(
+            summary_table,
+            title=f"[bold blue]📊 预约结果汇总 ({succeeded}/{len(reservation_results)})[/bold blue]",
+        )
+    )
+    logger.info(f"预约结果汇总 - 成功 {succeeded}, 共 {len(reservation_results)}")
 
 
 if __name__ == "__main__":
@@ -299,9 +874,21 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
+    started = time.perf_counter()
+
     # 加载配置
     data = load_config(args.config)
 
+    # 各主机的并发与速率限制，所有学生的请求共用
+    configure_limits(data.get("limits"))
+
+    # 开放时刻前后是否暂存 rich 输出
+    console.enabled = data.get("quiet_window", True)
+
+    # 退出时将各阶段耗时汇总写入 JSON
+    if data.get("metrics_file", "metrics.json"):
+        atexit.register(metrics.registry.dump, data.get("metrics_file", "metrics.json"))
+
     # 显示启动标题
     console.print(
         Panel(
@@ -311,95 +898,99 @@ if __name__ == "__main__":
     )
 
     try:
-        # 验证配置文件
-        validate_config(data)
+        # 解析并验证配置文件
+        students = get_students(data)
+        validate_config(students)
+
+        # 在本进程内启动短信验证码接收服务
+        if data.get("sms_server"):
+            start_sms_server(data["sms_server"])
+
+        # 打开任务状态库，当前配置中仍有未完成任务的学生视为崩溃重启，跳过登录测试
+        store_path = data.get("job_store", jobstore.DEFAULT_PATH)
+        if store_path:
+            store = jobstore.open_store(store_path)
+        tags = [
+            job_tag(student["username"], appointments[0]["yyrq"])
+            for student in students
+            for appointments in group_appointments(student)
+        ]
+        known = store.unfinished_students(tags) if store else set()
+        resumed = [student for student in students if str(student["username"]) in known]
+        if resumed:
+            console.print(
+                f"[bold blue]♻️ 从任务状态库恢复 {len(resumed)} 个学生的任务，跳过其登录测试[/bold blue]"
+            )
+            logger.info(f"从 {store_path} 恢复 {len(resumed)} 个学生的任务")
 
-        # 测试学生的登录
-        if not test_logins(data):
+        # 测试学生的登录，登录失败的学生不影响其它学生
+        total_students = len(students)
+        admitted.update(str(student["username"]) for student in resumed)
+        students = admit_students(students)
+        if not students:
             console.print("[bold red]✗ 登录测试失败，请检查配置后重试[/bold red]")
             logger.error("登录测试失败")
             exit(1)
-
-        appointments = data["appointments"]
-        student_config = {
-            "username": data["username"],
-            "password": data["password"],
-            "phone": data["phone"],
-            "bark": data.get("bark", None),
-            "auto": data["auto"],
-        }
+        if len(students) < total_students:
+            console.print(
+                f"[bold yellow]⚠️ {total_students - len(students)} 个学生登录失败，将跳过其预约[/bold yellow]"
+            )
 
         # 显示预约总览
         overview_table = Table()
         overview_table.add_column("项目", style="cyan")
         overview_table.add_column("数值", style="white")
-        overview_table.add_row("学生数量", "1")
-        overview_table.add_row("预约任务", str(len(appointments)))
-        overview_table.add_row("自动模式", "✓ 开启" if data["auto"] else "✗ 关闭")
+        overview_table.add_row("学生数量", str(len(students)))
+        overview_table.add_row(
+            "预约任务", str(sum(len(student["appointments"]) for student in students))
+        )
+        overview_table.add_row(
+            "自动模式",
+            f"{sum(1 for student in students if student['auto'])}/{len(students)} 开启",
+        )
 
         console.print(
             Panel(overview_table, title="[bold magenta]📈 系统概览[/bold magenta]")
         )
 
-        # 为每个预约安排调度 - 按配置顺序串行处理
-        immediate_tasks = 0
-        scheduled_tasks = 0
-
+        # 同一学生、同一开放时间的预约合并为一个任务，到点后各自在独立线程中执行
         with console.status("[bold blue]正在安排预约任务..."):
-            for appointment in appointments:
-                target_day = datetime.strptime(str(appointment["yyrq"]), "%Y%m%d")
-                now = datetime.now()
-                open_time = (target_day - timedelta(days=3)).replace(
-                    hour=8, minute=0, second=1, microsecond=0
-                )
-                time_diff = (open_time - now).total_seconds()
-
-                if time_diff <= 0:
-                    immediate_tasks += 1
-                else:
-                    scheduled_tasks += 1
+            schedule_students(students)
 
-                schedule_appointment(appointment, student_config)
-
-        # 如果所有任务都是立即执行的，程序应该立即退出
-        if immediate_tasks > 0 and scheduled_tasks == 0:
-            console.print(
-                Panel(
-                    "[green]✓ 所有预约任务已立即执行完成，程序即将退出[/green]",
-                    title="[bold green]🎉 任务完成[/bold green]",
-                )
-            )
-            logger.info("所有预约任务均为立即执行且已完成，程序正常退出")
-            exit(0)
+        # 监视配置文件，修改后增量调度，无需重启
+        if data.get("hot_reload", True):
+            watcher.watch(args.config, reload_config)
 
         console.print(
             Panel(
-                f"[green]✓ 调度器启动成功，正在监控 {scheduled_tasks} 个预约任务...[/green]\n"
+                f"[green]✓ 调度器启动成功，正在监控 {len(scheduler.jobs)} 个预约任务...[/green]\n"
                 + "[yellow]⚠️ 请保持程序运行，按 Ctrl+C 停止[/yellow]",
                 title="[bold green]🚀 系统运行中[/bold green]",
             )
         )
-
         logger.info(
-            f"系统启动成功 - 立即执行: {immediate_tasks}, 调度任务: {scheduled_tasks}"
+            f"系统启动成功 - 调度任务: {len(scheduler.jobs)}，"
+            f"启动耗时 {(time.perf_counter() - started) * 1000:.0f} ms"
         )
 
-        # 主循环
-        while True:
-            schedule.run_pending()
-
-            # 检查是否还有待执行的任务
-            if len(schedule.jobs) == 0:
-                console.print(
-                    Panel(
-                        "[green]✓ 所有预约任务已完成，程序即将退出[/green]",
-                        title="[bold green]🎉 任务完成[/bold green]",
-                    )
-                )
-                logger.info("所有预约任务已完成，程序正常退出")
-                break
+        # 主循环：阻塞直到所有任务触发并执行完毕
+        scheduler.run()
 
-            time.sleep(1)
+        print_summary()
+        console.print(
+            Panel(
+                "[green]✓ 所有预约任务已完成，程序即将退出[/green]",
+                title="[bold green]🎉 任务完成[/bold green]",
+            )
+        )
+        logger.info(
+            "所有预约任务已完成，程序正常退出，触发偏差（派发 / 提交）: "
+            + ", ".join(
+                f"{job.tag}={job.jitter * 1000:.3f}ms / "
+                + ("-" if job.fire_jitter is None else f"{job.fire_jitter * 1000:.3f}ms")
+                for job in scheduler.history
+            )
+        )
 
     except KeyboardInterrupt:
         console.print("\n[bold yellow]👋 程序已由用户中断[/bold yellow]")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   metrics.py
+# @Time    :   2025/08/25 15:40:02
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import bisect
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from loguru import logger
+
+METRIC_NAME = "pku_reservation_phase_seconds"
+# 直方图分桶上界（秒），覆盖单个请求到等待验证码的时间范围
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LABELS = ("student", "date", "visitor", "phase")
+# 每个序列保留的最近样本数，用于计算分位数
+MAX_SAMPLES = 10000
+
+# 当前线程 / 协程的标签（学生、日期、被预约人）；asyncio 任务与 to_thread 会继承，线程池中需重新设置
+_labels = contextvars.ContextVar("metrics_labels", default={})
+
+
+@contextmanager
+def labels(**values):
+    """在上下文中附加标签，其中的计时都会带上这些标签"""
+    token = _labels.set({**_labels.get(), **{k: str(v) for k, v in values.items()}})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+class _Series:
+    def __init__(self) -> None:
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS):
+            self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.samples.append(seconds)
+
+
+def _quantile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _stats(samples, count, total):
+    values = sorted(samples)
+    return {
+        "count": count,
+        "sum": round(total, 6),
+        "mean": round(total / count, 6),
+        "p50": round(_quantile(values, 0.5), 6),
+        "p95": round(_quantile(values, 0.95), 6),
+        "max": round(values[-1], 6),
+    }
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """进程内的分阶段耗时直方图，按 (学生, 日期, 被预约人, 阶段) 分序列"""
+
+    def __init__(self) -> None:
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds, **values):
+        merged = {**_labels.get(), **{k: str(v) for k, v in values.items()}}
+        merged["phase"] = phase
+        key = tuple(merged.get(label, "") for label in LABELS)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase, **values):
+        """记录上下文的耗时，异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started, **values)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = [
+            f"# HELP {METRIC_NAME} Latency of each reservation phase in seconds.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                label_str = ",".join(
+                    f'{label}="{_escape(value)}"' for label, value in zip(LABELS, key)
+                )
+                cumulative = 0
+                for bound, count in zip(BUCKETS, series.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'{METRIC_NAME}_bucket{{{label_str},le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{METRIC_NAME}_bucket{{{label_str},le="+Inf"}} {series.count}')
+                lines.append(f"{METRIC_NAME}_sum{{{label_str}}} {series.sum}")
+                lines.append(f"{METRIC_NAME}_count{{{label_str}}} {series.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """按阶段汇总及按序列明细的 count / sum / mean / p50 / p95 / max"""
+        with self._lock:
+            items = [
+                (key, list(series.samples), series.count, series.sum)
+                for key, series in sorted(self._series.items())
+            ]
+
+        phases = {}
+        for key, samples, count, total in items:
+            phase = phases.setdefault(key[-1], [[], 0, 0.0])
+            phase[0].extend(samples)
+            phase[1] += count
+            phase[2] += total
+
+        return {
+            "phases": {
+                phase: _stats(samples, count, total)
+                for phase, (samples, count, total) in phases.items()
+            },
+            "series": [
+                dict(zip(LABELS, key), **_stats(samples, count, total))
+                for key, samples, count, total in items
+            ],
+        }
+
+    def dump(self, path):
+        """将汇总写入 JSON 文件，没有任何样本时不写"""
+        if not self._series:
+            return
+        try:
+            with open(path, "w") as f:
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+            logger.info(f"耗时统计已写入 {path}")
+        except OSError as e:
+            logger.warning(f"写入耗时统计失败: {e}")
+
+
+registry = Registry()
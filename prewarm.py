@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   prewarm.py
+# @Time    :   2025/08/23 11:20:13
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import socket
+import threading
+
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util import connection
+
+# 预约流程涉及的主机
+HOSTS = ("iaaa.pku.edu.cn", "portal.pku.edu.cn", "simso.pku.edu.cn")
+# 保活请求使用的地址，HEAD 静态页面即可
+KEEPALIVE_URL = "https://simso.pku.edu.cn/"
+# 保活请求间隔（秒），需小于服务器的 keep-alive 空闲超时
+KEEPALIVE_INTERVAL = 15
+# 开放前停止保活的提前秒数，保证开放时刻连接均处于空闲状态
+KEEPALIVE_GUARD = 1
+
+# 已固定的主机地址：host -> ip
+_pinned = {}
+_pinned_lock = threading.Lock()
+_original_create_connection = connection.create_connection
+
+
+def _create_connection(address, *args, **kwargs):
+    host, port = address
+    return _original_create_connection(
+        (_pinned.get(host, host), port), *args, **kwargs
+    )
+
+
+def pin_hosts(hosts=HOSTS, port=443):
+    """解析并固定主机地址，之后 requests 建立连接时不再进行 DNS 查询
+
+    仅替换 TCP 连接的目标地址，TLS 的 SNI 与证书校验仍使用原主机名。
+    """
+    with _pinned_lock:
+        for host in hosts:
+            try:
+                infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            except OSError as e:
+                logger.warning(f"解析 {host} 失败: {e}")
+                continue
+            _pinned[host] = infos[0][4][0]
+        connection.create_connection = _create_connection
+        logger.debug(f"已固定主机地址: {_pinned}")
+        return dict(_pinned)
+
+
+def make_adapter(pool_maxsize):
+    """每个主机一个连接池，每个池按并发提交数保留连接"""
+    return HTTPAdapter(
+        pool_connections=len(HOSTS),
+        pool_maxsize=max(pool_maxsize, 1),
+        max_retries=0,
+    )
+
+
+def ping(session, count=1, url=KEEPALIVE_URL, timeout=5):
+    """同时发出 count 个 HEAD 请求，建立或保活 count 个连接"""
+    barrier = threading.Barrier(count)
+
+    def head():
+        try:
+            barrier.wait(timeout)
+            session.head(url, timeout=timeout)
+        except (threading.BrokenBarrierError, OSError) as e:
+            logger.debug(f"保活请求失败: {e}")
+
+    threads = [threading.Thread(target=head, daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
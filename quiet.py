@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   quiet.py
+# @Time    :   2025/08/27 10:05:44
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import threading
+from contextlib import contextmanager
+
+from rich.console import Console
+
+
+class DeferredConsole(Console):
+    """开放时刻前后的静默窗口内暂存 rich 输出，最后一个窗口结束后统一渲染
+
+    多个预约任务的窗口可以重叠，任一任务仍在提交时其它任务的输出也会暂存，
+    避免渲染面板、表格占用发起请求的线程与 GIL。
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._hold_lock = threading.Lock()
+        self._hold_depth = 0
+        self._pending = []
+        # 为 False 时不暂存，与普通 Console 相同
+        self.enabled = True
+
+    def print(self, *objects, **kwargs):
+        with self._hold_lock:
+            if self._hold_depth:
+                self._pending.append((objects, kwargs))
+                return
+        super().print(*objects, **kwargs)
+
+    @contextmanager
+    def hold(self):
+        """进入静默窗口，退出最后一个窗口时输出暂存的内容"""
+        if not self.enabled:
+            yield
+            return
+
+        with self._hold_lock:
+            self._hold_depth += 1
+        try:
+            yield
+        finally:
+            with self._hold_lock:
+                self._hold_depth -= 1
+                pending = [] if self._hold_depth else self._pending
+                if not self._hold_depth:
+                    self._pending = []
+            for objects, kwargs in pending:
+                super().print(*objects, **kwargs)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   retry.py
+# @Time    :   2025/08/24 20:18:55
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from loguru import logger
+
+# 开放后持续重试的默认秒数，0 表示不重试
+DEFAULT_RETRY_WINDOW = 10
+# 重试间隔（秒），实际间隔在 [1 - RETRY_JITTER, 1 + RETRY_JITTER] 倍之间随机
+DEFAULT_RETRY_INTERVAL = 0.1
+RETRY_JITTER = 0.5
+# 单个操作的最大尝试次数
+MAX_ATTEMPTS = 50
+
+RETRY = "retry"
+FATAL = "fatal"
+
+# simso msg 中包含这些提示时不再重试（名额已满、重复申请等）
+FATAL_HINTS = ("已满", "约满", "名额", "重复", "已存在", "已预约", "已申请", "验证码")
+# simso msg 中包含这些提示时视为暂时性失败（尚未开放、系统繁忙等）
+RETRYABLE_HINTS = ("未开放", "未开始", "尚未", "不在", "稍后", "繁忙", "频繁", "异常", "超时")
+
+
+class SimsoError(AssertionError):
+    """simso 返回 success 为 false；继承 AssertionError 以兼容原有的异常处理"""
+
+    def __init__(self, json) -> None:
+        self.json = json
+        self.msg = str(json.get("msg", ""))
+        self.code = json.get("code")
+        super().__init__(self.msg)
+
+
+def _status_code(exc):
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def classify(exc):
+    """将失败分为可重试（RETRY）与不可重试（FATAL）
+
+    simso 的失败只能按 msg 分类：code 只区分成功（1）与失败（0），不携带失败原因，
+    因此 SimsoError.code 仅保留供日志与调试使用。
+    """
+    if isinstance(exc, SimsoError):
+        if any(hint in exc.msg for hint in FATAL_HINTS):
+            return FATAL
+        if any(hint in exc.msg for hint in RETRYABLE_HINTS):
+            return RETRY
+        # 未知提示：开放瞬间的返回多为暂时性状态，在有限窗口内重试
+        return RETRY
+
+    status_code = _status_code(exc)
+    if status_code is not None:
+        return RETRY if status_code >= 500 or status_code == 429 else FATAL
+
+    # requests / httpx 的连接错误与超时
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {"ConnectionError", "Timeout", "TimeoutError", "TransportError"}:
+        return RETRY
+    return FATAL
+
+
+def ambiguous(exc):
+    """失败的请求是否可能已被服务端处理：5xx、读超时、连接中断等
+
+    simso 明确返回失败、429 与建连阶段的错误都不会产生服务端状态。
+    """
+    if isinstance(exc, SimsoError):
+        return False
+    status_code = _status_code(exc)
+    if status_code is not None:
+        return status_code >= 500
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {"ConnectTimeout", "ConnectError"}:
+        return False
+    return classify(exc) == RETRY
+
+
+class BurstRetry:
+    """开放时刻的突发重试：在截止时刻前以带抖动的短间隔重试可重试的失败
+
+    每次尝试的耗时与结果都记录在 attempts 中。
+    """
+
+    def __init__(
+        self,
+        deadline,
+        interval=DEFAULT_RETRY_INTERVAL,
+        max_attempts=MAX_ATTEMPTS,
+    ) -> None:
+        # 截止时刻为本地时间，换算为单调时钟
+        self._deadline = time.monotonic() + (deadline - datetime.now()).total_seconds()
+        self._interval = interval
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.attempts = []
+
+    def _record(self, op, attempt, started, outcome, detail=""):
+        with self._lock:
+            self.attempts.append(
+                {
+                    "op": op,
+                    "attempt": attempt,
+                    "latency": time.monotonic() - started,
+                    "outcome": outcome,
+                    "detail": detail,
+                }
+            )
+
+    def _next_delay(self, op, attempt, exc):
+        """返回下次重试前的等待秒数，不应重试时返回 None"""
+        kind = classify(exc)
+        if kind == FATAL or attempt >= self._max_attempts:
+            return None
+        delay = self._interval * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+        if time.monotonic() + delay > self._deadline:
+            return None
+        logger.warning(f"{op} 第 {attempt} 次尝试失败（{exc}），{delay * 1000:.0f} ms 后重试")
+        return delay
+
+    def call(self, op, func, *args, on_ambiguous=None, **kwargs):
+        """重试 func；此前有可能已被服务端处理的失败时，成功后调用 on_ambiguous(结果, 失败列表)"""
+        attempt = 0
+        unsure = []
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._record(op, attempt, started, classify(e), str(e))
+                delay = self._next_delay(op, attempt, e)
+                if delay is None:
+                    raise
+                if ambiguous(e):
+                    unsure.append(e)
+                time.sleep(delay)
+                continue
+            self._record(op, attempt, started, "success")
+            if unsure and on_ambiguous:
+                on_ambiguous(result, unsure)
+            return result
+
+    async def acall(self, op, func, *args, on_ambiguous=None, **kwargs):
+        attempt = 0
+        unsure = []
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                self._record(op, attempt, started, classify(e), str(e))
+                delay = self._next_delay(op, attempt, e)
+                if delay is None:
+                    raise
+                if ambiguous(e):
+                    unsure.append(e)
+                await asyncio.sleep(delay)
+                continue
+            self._record(op, attempt, started, "success")
+            if unsure and on_ambiguous:
+                on_ambiguous(result, unsure)
+            return result
+
+    def summary(self):
+        """按操作与结果统计尝试次数及平均耗时"""
+        with self._lock:
+            attempts = list(self.attempts)
+        counts = Counter((a["op"], a["outcome"]) for a in attempts)
+        lines = []
+        for (op, outcome), count in sorted(counts.items()):
+            latencies = [
+                a["latency"] for a in attempts if a["op"] == op and a["outcome"] == outcome
+            ]
+            lines.append(
+                f"{op}/{outcome}: {count} 次, 平均 {sum(latencies) / count * 1000:.1f} ms"
+            )
+        return "; ".join(lines)
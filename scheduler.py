@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   scheduler.py
+# @Time    :   2025/08/20 21:14:36
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import threading
+import time
+from datetime import datetime
+
+from loguru import logger
+
+# 距离目标时刻多少秒时从粗睡眠切换到精细等待
+COARSE_MARGIN = 0.3
+# 距离目标时刻多少秒时从精细睡眠切换到自旋
+SPIN_MARGIN = 0.002
+# 粗睡眠单次最长秒数，期间会重新对照系统时间校正
+MAX_COARSE_SLEEP = 60
+
+# 任务线程中当前正在执行的任务
+_local = threading.local()
+
+
+def sleep_until(moment):
+    """高精度等待到指定的本地时刻
+
+    先按系统时间分段粗睡眠到目标前 COARSE_MARGIN 秒，再换算为单调时钟的截止点
+    精细睡眠并自旋，避免等待期间系统时间调整带来的跳变。
+    返回实际触发时刻相对目标的偏差（秒，正数表示迟到）。
+    """
+    while True:
+        remaining = (moment - datetime.now()).total_seconds()
+        if remaining <= COARSE_MARGIN:
+            break
+        time.sleep(min(remaining - COARSE_MARGIN, MAX_COARSE_SLEEP))
+
+    deadline = time.monotonic() + (moment - datetime.now()).total_seconds()
+    remaining = deadline - time.monotonic()
+    if remaining > SPIN_MARGIN:
+        time.sleep(remaining - SPIN_MARGIN)
+    while time.monotonic() < deadline:
+        # 让出 GIL，避免多个等待线程互相拖慢
+        time.sleep(0)
+
+    return time.monotonic() - deadline
+
+
+class Job:
+    def __init__(self, when, func, args, kwargs, tag=None) -> None:
+        self.when = when
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.tag = tag
+        # 派发时刻相对 when 的偏差（秒），触发后写入
+        self.jitter = None
+        # 任务内开放时刻提交相对目标时刻的偏差（秒），由任务经 current_job() 写入；
+        # 提前派发用于预热的任务，真正决定提交时机的是这一偏差
+        self.fire_jitter = None
+
+    def __repr__(self) -> str:
+        return f"Job(tag={self.tag!r}, when={self.when:%Y-%m-%d %H:%M:%S.%f})"
+
+
+def current_job():
+    """当前线程正在执行的任务，不在任务线程中时为 None"""
+    return getattr(_local, "job", None)
+
+
+def _run(job):
+    _local.job = job
+    job.func(*job.args, **job.kwargs)
+
+
+class FiringScheduler:
+    """一次性任务的高精度触发调度器
+
+    每个任务到点后在独立线程中执行，一个任务的等待或阻塞不会推迟其它任务。
+    """
+
+    def __init__(self) -> None:
+        self._jobs = []
+        self._threads = []
+        self._cond = threading.Condition()
+        # 已触发的任务，用于事后查看触发偏差
+        self.history = []
+
+    @property
+    def jobs(self):
+        """尚未触发的任务"""
+        with self._cond:
+            return list(self._jobs)
+
+    def add(self, when, func, *args, tag=None, **kwargs):
+        """安排任务在本地时刻 when 执行"""
+        job = Job(when, func, args, kwargs, tag=tag)
+        with self._cond:
+            self._jobs.append(job)
+            self._jobs.sort(key=lambda j: j.when)
+            self._cond.notify()
+        return job
+
+    def cancel(self, tag):
+        """取消指定 tag 的尚未触发的任务，返回取消的数量"""
+        with self._cond:
+            before = len(self._jobs)
+            self._jobs = [job for job in self._jobs if job.tag != tag]
+            self._cond.notify()
+            return before - len(self._jobs)
+
+    def run(self):
+        """阻塞运行，直到所有任务都已触发并执行完毕"""
+        while True:
+            with self._cond:
+                self._threads = [t for t in self._threads if t.is_alive()]
+                if not self._jobs:
+                    if not self._threads:
+                        return
+                    self._cond.wait(1)
+                    continue
+
+                job = self._jobs[0]
+                remaining = (job.when - datetime.now()).total_seconds()
+                if remaining > COARSE_MARGIN:
+                    # 粗睡眠期间新增或取消任务会唤醒并重新选择
+                    self._cond.wait(min(remaining - COARSE_MARGIN, MAX_COARSE_SLEEP))
+                    continue
+                self._jobs.pop(0)
+
+            job.jitter = sleep_until(job.when)
+            self._dispatch(job)
+
+    def _dispatch(self, job):
+        logger.debug(f"触发任务 {job.tag}，偏差 {job.jitter * 1000:.3f} ms")
+        self.history.append(job)
+        thread = threading.Thread(
+            target=_run,
+            args=(job,),
+            name=str(job.tag),
+            daemon=True,
+        )
+        with self._cond:
+            self._threads.append(thread)
+        thread.start()
@@ -7,72 +7,263 @@
 # @Software:   Visual Studio Code
 
 
-from fastapi import FastAPI, Request, Response
+import asyncio
+import itertools
 import os
+import queue
 import re
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
 from rich.console import Console
 
+import codes
+import metrics
+
 app = FastAPI()
 console = Console()
 
-password = "123456"
+# Authorization 头的鉴权令牌：优先读取环境变量 PKU_SMS_TOKEN，
+# 与 main.py 同进程运行时可在 sms_server.token 中配置；都未设置时沿用旧的默认值
+DEFAULT_TOKEN = "123456"
+token = os.environ.get("PKU_SMS_TOKEN", DEFAULT_TOKEN)
+
+# 验证码有效期（秒），与短信中的“2分钟内完成操作”一致
+CODE_TTL = codes.CODE_TTL
+# 每个学号最多保留的验证码数
+MAX_CODES = codes.MAX_CODES
+# 长轮询的最长等待时间（秒）
+MAX_POLL_TIMEOUT = codes.CODE_TIMEOUT
+
+CODE_PATTERN = re.compile(r"\d{6}")
+STUDENT_ID_PATTERN = re.compile(r"\d{10}")
+
+
+def configure(new_token=None):
+    """设置鉴权令牌，None 表示保持不变"""
+    global token
+    if new_token is not None:
+        token = str(new_token)
+
+
+def authorized(request: Request):
+    """常数时间比较 Authorization 头，兼容 Bearer 前缀"""
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        header = header[len("Bearer ") :]
+    return secrets.compare_digest(header.encode(), token.encode())
+
+
+class CodeStore:
+    """按学号保存近期验证码，过期自动丢弃，重复转发的验证码只记录一次
+
+    每条验证码分配一个全局递增的序号，长轮询方以序号为游标等待新验证码。
+    只在事件循环中访问，无需加锁。
+    """
+
+    def __init__(self, ttl=CODE_TTL) -> None:
+        self.ttl = ttl
+        # 学号 -> deque[(序号, 验证码, 收到时间)]
+        self._codes = {}
+        # 学号 -> 长轮询等待的事件，新验证码到达时置位并移除
+        self._events = {}
+        self._seq = itertools.count(1)
+
+    def _entries(self, student_id):
+        entries = self._codes.get(student_id)
+        if entries is None:
+            return ()
+        expires = time.time() - self.ttl
+        while entries and entries[0][2] < expires:
+            entries.popleft()
+        if not entries:
+            del self._codes[student_id]
+        return entries
+
+    def add(self, student_id, code):
+        """记录验证码，返回 (记录, 是否为重复转发)"""
+        for entry in self._entries(student_id):
+            if entry[1] == code:
+                return entry, True
+        entry = (next(self._seq), code, time.time())
+        self._codes.setdefault(student_id, deque(maxlen=MAX_CODES)).append(entry)
+        event = self._events.pop(student_id, None)
+        if event:
+            event.set()
+        return entry, False
+
+    def cursor(self, student_id):
+        """学号当前最新验证码的序号，没有时为 0"""
+        entries = self._entries(student_id)
+        return entries[-1][0] if entries else 0
+
+    def after(self, student_id, seq):
+        """序号大于 seq 的最早一条未过期验证码"""
+        for entry in self._entries(student_id):
+            if entry[0] > seq:
+                return entry
+        return None
+
+    async def wait(self, student_id, seq, timeout):
+        """等待序号大于 seq 的验证码，超时返回 None"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            entry = self.after(student_id, seq)
+            if entry:
+                return entry
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            event = self._events.setdefault(student_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+store = CodeStore()
+
+# 写验证码文件与控制台输出在后台线程中执行，不阻塞事件循环
+_tasks = queue.SimpleQueue()
+
+
+def _worker():
+    while True:
+        func, args = _tasks.get()
+        try:
+            func(*args)
+        except Exception as e:
+            console.print(f"[red]❌ 后台任务失败: {e}[/red]")
+
+
+threading.Thread(target=_worker, name="sms_writer", daemon=True).start()
+
+
+def _background(func, *args):
+    _tasks.put((func, args))
+
+
+def _log(message):
+    _background(console.print, message)
+
+
+def _save_code(student_id, code, content, pushed):
+    # 已推送时等待方已拿到验证码，不再写文件：后台写入可能晚于等待方清空文件，留下旧验证码
+    if pushed:
+        console.print(f"[green]✅ 收到学号 {student_id} 的验证码 {code}，已推送[/green]")
+    else:
+        with open(f"{student_id}.txt", "w") as f:
+            f.write(code)
+        console.print(
+            f"[green]✅ 收到学号 {student_id} 的验证码 {code}，已写入 {student_id}.txt[/green]"
+        )
+    console.print(f"[dim]短信内容: {content}[/dim]")
+
+
+def _entry_json(student_id, entry):
+    seq, code, received_at = entry
+    return {"student_id": student_id, "code": code, "seq": seq, "received_at": received_at}
 
 
 @app.post("/pku_sms")
 async def sms(request: Request):
-    headers = request.headers
-    if headers.get("Authorization", None) != password:
-        console.print("[red]❌ 未授权的请求[/red]")
+    if not authorized(request):
+        _log("[red]❌ 未授权的请求[/red]")
         return Response(status_code=403)
 
-    data = await request.json()
+    try:
+        data = await request.json()
+    except ValueError:
+        _log("[yellow]⚠️ 请求体不是合法的 JSON[/yellow]")
+        return Response(status_code=400)
     content = data.get("content", "")
     student_id = data.get("id", None)
 
     if not content:
-        console.print("[yellow]⚠️ 缺少短信内容[/yellow]")
+        _log("[yellow]⚠️ 缺少短信内容[/yellow]")
         return Response(status_code=400)
 
     # 尝试从短信内容中提取验证码（6位数字）
-    code_match = re.search(r'\d{6}', content)
+    code_match = CODE_PATTERN.search(content)
     if not code_match:
-        console.print("[yellow]⚠️ 无法从短信内容中提取验证码[/yellow]")
+        _log("[yellow]⚠️ 无法从短信内容中提取验证码[/yellow]")
         return Response(status_code=400)
-    
+
     verification_code = code_match.group()
 
     # 确定学号：优先使用请求体中的student_id，否则尝试从内容中提取
     if not student_id:
         # 尝试从短信内容中提取学号（假设学号为10位数字）
-        id_match = re.search(r'\d{10}', content)
+        id_match = STUDENT_ID_PATTERN.search(content)
         if id_match:
             student_id = id_match.group()
         else:
-            console.print("[red]❌ 无法确定学号，请在请求体中指定student_id[/red]")
+            _log("[red]❌ 无法确定学号，请在请求体中指定student_id[/red]")
             return Response(status_code=400)
+    student_id = str(student_id)
 
-    # 创建学号特定的验证码文件
-    code_filename = f"{student_id}.txt"
-    code_filepath = os.path.join("./", code_filename)
+    entry, duplicate = store.add(student_id, verification_code)
+    result = {"status": "success", **_entry_json(student_id, entry), "duplicate": duplicate}
+    if duplicate:
+        # 转发端重试：同一验证码已处理过，不再重复推送给等待方
+        return result
 
-    with open(code_filepath, "w") as f:
-        f.write(verification_code)
+    # 推送给正在等待的预约进程，无需等待其轮询验证码文件
+    pushed = codes.push(student_id, verification_code)
+    _background(_save_code, student_id, verification_code, content, pushed)
+    return {**result, "pushed": pushed}
 
-    console.print(
-        f"[green]✅ 收到学号 {student_id} 的验证码 {verification_code}，已写入 {code_filename}[/green]"
-    )
-    console.print(f"[dim]短信内容: {content}[/dim]")
 
-    return {"status": "success", "student_id": student_id, "code": verification_code, "file": code_filename}
+@app.get("/pku_sms/{student_id}")
+async def poll(
+    request: Request, student_id: str, after: Optional[int] = None, timeout: float = 30
+):
+    """长轮询：等待序号大于 after 的验证码，省略 after 时等待下一条新验证码
+
+    超时返回 204，X-Code-Seq 头为当前最新序号，可作为下次请求的 after。
+    """
+    if not authorized(request):
+        _log("[red]❌ 未授权的请求[/red]")
+        return Response(status_code=403)
+
+    if after is None:
+        after = store.cursor(student_id)
+    entry = await store.wait(student_id, after, min(max(timeout, 0), MAX_POLL_TIMEOUT))
+    if entry is None:
+        return Response(
+            status_code=204, headers={"X-Code-Seq": str(store.cursor(student_id))}
+        )
+    return _entry_json(student_id, entry)
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    # 与 main.py 同进程运行（sms_server）时，包含预约各阶段的耗时直方图；
+    # 标签中有学号与被预约人姓名，与 /pku_sms 使用同一鉴权
+    if not authorized(request):
+        _log("[red]❌ 未授权的请求[/red]")
+        return Response(status_code=403)
+    return PlainTextResponse(
+        metrics.registry.render(), media_type="text/plain; version=0.0.4"
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
 
     console.print("[bold blue]🚀 启动 PKU 短信验证码接收服务器[/bold blue]")
-    console.print(
-        f"[yellow]请确保在请求时配置正确的Authorization头: {password}[/yellow]"
-    )
+    if token == DEFAULT_TOKEN:
+        console.print(
+            f"[yellow]正在使用默认的 Authorization 令牌 {DEFAULT_TOKEN}，建议通过环境变量 PKU_SMS_TOKEN 修改[/yellow]"
+        )
+    else:
+        console.print("[yellow]请确保在请求时配置正确的Authorization头（环境变量 PKU_SMS_TOKEN）[/yellow]")
     console.print(
         "[cyan]支持的请求体格式:[/cyan]\n" +
         '{\n' +
@@ -80,4 +271,4 @@ if __name__ == "__main__":
         '    "id": "2110000000"\n' +
         '}'
     )
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -7,9 +7,15 @@
 # @Software:   Visual Studio Code
 
 
+import atexit
+import queue
 import random
 import re
+import threading
 import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import wraps
 from urllib import parse
 
@@ -17,37 +23,103 @@ import pyotp
 import requests
 from loguru import logger
 
-
-class Session(requests.Session):
-    def __init__(self, config, notifier=None, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self._config = config
-        self._config["yysj"] = self._normalize_time(self._config["yysj"])
-        self._notifier = notifier
-        self.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-                "Accept-Language": "zh-CN,zh;q=0.9",
-                "Accept-Encoding": "gzip, deflate",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-                "Cache-Control": "max-age=0",
-                "TE": "Trailers",
-                "Pragma": "no-cache",
-                "Referer": f"https://simso.pku.edu.cn/pages/sadEpiVisitorAppt.html?_sk={self._config['username']}",
-            }
+import codes
+import hedge
+import limiter
+import metrics
+import prewarm
+import session_cache
+from clock import ClockOffsetEstimator
+from retry import SimsoError
+
+# sid 有效性缓存的默认有效期（秒）
+DEFAULT_SID_TTL = 300
+# simso 返回的 msg 中包含这些提示时，视为 sid 已失效
+AUTH_FAILURE_HINTS = ("未登录", "重新登录", "登录超时", "会话", "sid")
+# Bark 推送的超时秒数
+BARK_TIMEOUT = 5
+# 合并推送的等待窗口（秒），窗口内同一 key 的消息合并为一条推送
+BARK_COALESCE_WINDOW = 1.0
+SIMSO_API = "https://simso.pku.edu.cn/ssapi"
+# 燕园与新燕园的预约接口前缀不同，但共用同一个 sid
+VISITOR_APPT_PATHS = {
+    "燕园": "stuaffair/epiVisitorAppt",
+    "新燕园": "bwb/cpVisitorAppt",
+}
+
+
+def visitor_key(appointment, visitor_id):
+    """被预约人在任务状态库中的唯一标识：预约 + 证件号"""
+    return "|".join(
+        str(value)
+        for value in (
+            appointment["mode"],
+            appointment["yyrq"],
+            appointment["yyxm"],
+            appointment["yysj"],
+            visitor_id,
         )
-        self._base_url = "https://simso.pku.edu.cn/ssapi/"
+    )
 
-        assert self._config["mode"] in ["燕园", "新燕园"], "Invalid mode"
-        if self._config["mode"] == "燕园":
-            self._base_url += "stuaffair/epiVisitorAppt"
-        elif self._config["mode"] == "新燕园":
-            self._base_url += "bwb/cpVisitorAppt"
 
-    def __del__(self):
-        self.close()
+def default_headers(username):
+    return {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        "Upgrade-Insecure-Requests": "1",
+        "Cache-Control": "max-age=0",
+        "TE": "Trailers",
+        "Pragma": "no-cache",
+        "Referer": f"https://simso.pku.edu.cn/pages/sadEpiVisitorAppt.html?_sk={username}",
+    }
+
+
+class BaseSession:
+    """与 HTTP 后端无关的会话逻辑：配置、sid 有效性缓存、时钟采样与请求体构造
+
+    config["appointments"] 为同一学生、同一开放时刻的所有预约，共用一次登录；
+    每个请求按所属预约的 mode 路由到燕园或新燕园的接口。
+    """
+
+    def _setup(self, config, notifier) -> None:
+        self._config = config
+        for appointment in self._config["appointments"]:
+            assert appointment["mode"] in VISITOR_APPT_PATHS, "Invalid mode"
+            appointment["yysj"] = self._normalize_time(appointment["yysj"])
+        self._notifier = notifier
+        # sid 有效性缓存：最近一次确认有效的时刻，TTL 内不再调用 login_check
+        self._sid_checked_at = None
+        self._sid_ttl = self._config.get("sid_ttl") or DEFAULT_SID_TTL
+        # sid 的签发时刻（本地时间戳），随会话缓存保存，供心跳估计 sid 寿命
+        self.sid_issued_at = None
+        # checkSqrq 结果按 (mode, 预约日期) 缓存，同一批次只检查一次
+        self._status_cache = {}
+        # 短信验证码依赖同一个学号文件，并发提交时需串行获取
+        self._code_lock = codes.lock_for(self._config["username"])
+        # 根据 simso 响应时间戳估计服务器时钟偏移
+        self.clock = ClockOffsetEstimator()
+        # 开放时刻的突发重试，由调度方在触发前设置
+        self.retry = None
+        # 任务状态记录（jobstore.Journal），用于崩溃后恢复，由调度方设置
+        self.journal = None
+        # 流水线提交时限制同时进行 saveSqxx / submitSqxx 的被预约人数量
+        self._slots = None
+        # 真实地址 -> 替身地址（如本地模拟器），用于离线演练
+        self._hosts = self._config.get("hosts") or {}
+        # 预热阶段构造好的开放时刻请求，及构造时的 sid；sid 变化后作废
+        self._prepared = {}
+        self._prepared_sid = None
+        self._visitor_list = None
+        # 对冲或重试保存产生的（可能的）重复申请：(被预约人, 保留的 sqxxid, 重复的 sqxxid)，
+        # 重试时重复的 sqxxid 未知，记为 None；重复的申请不会提交
+        self.duplicates = []
+
+    def _url(self, appointment, action):
+        """按预约的 mode 拼接预约接口地址"""
+        return f"{SIMSO_API}/{VISITOR_APPT_PATHS[appointment['mode']]}/{action}"
 
     def _normalize_time(self, time_value):
         if isinstance(time_value, str):
@@ -59,19 +131,378 @@ class Session(requests.Session):
         else:
             return str(time_value)
 
+    def _check_status_code(self, res):
+        """验证状态码，鉴权失败时清除 sid 有效性缓存"""
+        if res.status_code in (401, 403):
+            self.invalidate_sid()
+        res.raise_for_status()
+
+    def _parse(self, res):
+        """解析 simso 返回的 json，并据此刷新或清除 sid 有效性缓存、采样服务器时钟"""
+        json = res.json()
+        self.clock.add_response(res, json)
+        if json.get("success"):
+            self._sid_checked_at = time.monotonic()
+        elif any(hint in str(json.get("msg", "")) for hint in AUTH_FAILURE_HINTS):
+            self.invalidate_sid()
+        return json
+
+    def _rewrite(self, url):
+        """按配置的 hosts 将真实地址改写为替身服务器的地址"""
+        for origin, target in self._hosts.items():
+            if url.startswith(origin):
+                return target.rstrip("/") + url[len(origin):]
+        return url
+
+    @contextmanager
+    def _timer(self, url):
+        """按接口计时，阶段名为路径的最后一段，如 saveSqxx、oauthlogin
+
+        成功的 simso 请求同时计入对冲阈值的耗时样本。
+        """
+        path = parse.urlparse(str(url)).path.rstrip("/")
+        phase = path.rsplit("/", 1)[-1].removesuffix(".do") or "root"
+        started = time.perf_counter()
+        with metrics.registry.timer(phase, student=self._config["username"]):
+            yield
+        if str(url).startswith(SIMSO_API):
+            hedge.tracker.observe(phase, time.perf_counter() - started)
+
+    def _assert_success(self, json):
+        if not json["success"]:
+            raise SimsoError(json)
+
+    def sid_valid(self):
+        """sid 是否仍在有效性缓存的 TTL 内"""
+        return (
+            self._sid_checked_at is not None
+            and time.monotonic() - self._sid_checked_at < self._sid_ttl
+        )
+
+    def invalidate_sid(self):
+        """清除 sid 有效性缓存"""
+        self._sid_checked_at = None
+        self._status_cache.clear()
+
+    def _export_state(self):
+        """导出可跨进程复用的登录状态"""
+        return {
+            "sid": self.params["sid"],
+            "_sk": self.params["_sk"],
+            "issued_at": self.sid_issued_at,
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                }
+                for cookie in self._cookie_jar
+            ],
+        }
+
+    def _import_state(self, state):
+        self.params["sid"] = state["sid"]
+        self.params["_sk"] = state["_sk"]
+        self.sid_issued_at = state.get("issued_at")
+        for cookie in state["cookies"]:
+            self._cookie_jar.set_cookie(requests.cookies.create_cookie(**cookie))
+
+    def _forget_state(self):
+        self.params.pop("sid", None)
+        self.params.pop("_sk", None)
+        self.sid_issued_at = None
+        self.invalidate_sid()
+
+    def _use_cache(self):
+        return self._config.get("session_cache", True)
+
+    def _log_clock(self):
+        offset, uncertainty = self.clock.estimate()
+        logger.info(
+            f"服务器时钟偏移 {offset * 1000:+.1f} ms (±{uncertainty * 1000:.1f} ms)，"
+            f"采样 {len(self.clock)} 次"
+        )
+        return offset, uncertainty
+
+    def _build_template(self, appointment, visitor):
+        """构造 saveSqxx 请求体"""
+        """
+        {
+            "lxdh": "16666666666",
+            "yyrq": "20240101",
+            "yyxm": "东侧门",
+            "yysy": "游览",
+            "yysj": "10:00"
+            "byyrxm": "张三",
+            "byyrlxdh": "11111111111",
+            "byyrzjh": "110101200001011111",
+        }
+        """
+        template = {
+            "lxdh": self._config["phone"],
+            "yyrq": appointment["yyrq"],
+            "yyxm": appointment["yyxm"],
+            "yysj": appointment["yysj"],
+            "yysy": appointment["yysy"],
+        }
+        template.update(visitor)
+        return template
+
+    def _pool_size(self):
+        """连接池大小：每个同时在途的被预约人一个连接，对冲时再各备一条
+
+        流水线时前一位的 sendEcyzCode 与后一位的 saveSqxx 同时在途，再多备一条。
+        """
+        visitors = len(self._visitors())
+        size = max(min(self._config.get("concurrency", 1), visitors), 1)
+        if self._hedging():
+            size *= 2
+        if self._pipelined() and visitors > 1:
+            size += 1
+        return size
+
+    def _hedging(self):
+        return self._config.get("hedge", False)
+
+    def _reconcile(self, appointment, visitor):
+        """对冲保存的两个请求都成功时，只保留胜出的 sqxxid"""
+        name = self._label(appointment, visitor)
+
+        def reconcile(winner, extra):
+            if extra["row"] == winner["row"]:
+                return
+            logger.warning(
+                f"{name} 的对冲保存产生了重复申请 {extra['row']}，保留 {winner['row']}，重复的申请不会提交"
+            )
+            self.duplicates.append((name, winner["row"], extra["row"]))
+
+        return reconcile
+
+    def _reconcile_retry(self, appointment, visitor):
+        """saveSqxx 在可能已被服务端处理的失败（5xx、连接中断）后重试成功时，
+        服务端可能留下一个未返回的 sqxxid：记录下来，只提交重试得到的 sqxxid"""
+        name = self._label(appointment, visitor)
+
+        def reconcile(sqxxid, failures):
+            logger.warning(
+                f"{name} 的 saveSqxx 在 {len(failures)} 次可能已被服务端处理的失败后重试成功，"
+                f"服务端可能存在未知的重复申请，保留 {sqxxid}，重复的申请不会提交"
+            )
+            self.duplicates.append((name, sqxxid, None))
+
+        return reconcile
+
+    def _visitors(self):
+        """展开所有预约的被预约人，返回 (预约, simso 字段) 列表"""
+        if self._visitor_list is not None:
+            return self._visitor_list
+        return [
+            (
+                appointment,
+                {
+                    "byyrxm": visitor["name"],
+                    "byyrzjh": visitor["id"],
+                    "byyrlxdh": visitor["phone"],
+                },
+            )
+            for appointment in self._config.get("appointments", [])
+            for visitor in appointment.get("visitors", [])
+        ]
+
+    def _label(self, appointment, visitor):
+        """结果中的被预约人名称，多个预约共用会话时附上校门与时间"""
+        if len(self._config.get("appointments", [])) > 1:
+            return (
+                f"{visitor['byyrxm']} ({appointment['mode']} "
+                f"{appointment['yyxm']} {appointment['yysj']})"
+            )
+        return visitor["byyrxm"]
+
+    def _visitor_key(self, appointment, visitor):
+        """被预约人在任务状态库中的唯一标识"""
+        return visitor_key(appointment, visitor["byyrzjh"])
+
+    def _split_succeeded(self, visitors):
+        """排除此前已提交成功的被预约人，返回 (跳过的结果, 待提交的被预约人)"""
+        if not self.journal:
+            return [], visitors
+        succeeded = self.journal.succeeded()
+        skipped, pending = [], []
+        for appointment, visitor in visitors:
+            if self._visitor_key(appointment, visitor) in succeeded:
+                logger.info(f"跳过此前已提交成功的 {self._label(appointment, visitor)}")
+                skipped.append((self._label(appointment, visitor), True, "此前已提交成功"))
+            else:
+                pending.append((appointment, visitor))
+        return skipped, pending
+
+    def _prepare_targets(self):
+        """开放时刻要发送的请求：键 -> (方法, 地址, 查询参数, 请求体)"""
+        targets = {}
+        for appointment, visitor in self._visitors():
+            targets[("checkSqrq", appointment["mode"], appointment["yyrq"])] = (
+                "GET",
+                self._url(appointment, "checkSqrq"),
+                {"sqrq": appointment["yyrq"]},
+                None,
+            )
+            targets[("saveSqxx", self._visitor_key(appointment, visitor))] = (
+                "POST",
+                self._url(appointment, "saveSqxx"),
+                {},
+                self._build_template(appointment, visitor),
+            )
+        return targets
+
+    def _prepared_for(self, *key):
+        """返回预先构造的请求，未构造或 sid 已变化时返回 None"""
+        if self._prepared_sid is None or self._prepared_sid != self.params.get("sid"):
+            return None
+        return self._prepared.get(key)
+
+    def _pipelined(self):
+        """捷径模式下是否流水线获取验证码：前一位等待验证码时，后续被预约人继续保存、发送验证码"""
+        return (
+            self._config["auto"]
+            and self._config["totp_mode"] != "secret"
+            and self._config.get("pipeline", True)
+        )
+
+    def _code_rejected(self, e):
+        """流水线模式下 submitSqxx 因验证码错误失败"""
+        return self._pipelined() and "验证码" in e.msg
+
+    def _slot(self):
+        return self._slots or nullcontext()
+
+    def _reset_status(self):
+        """每个批次重新检查一次各预约日期"""
+        self._status_cache.clear()
+
+
+class Session(BaseSession, requests.Session):
+    def __init__(self, config, notifier=None, *args, **kwargs) -> None:
+        requests.Session.__init__(self, *args, **kwargs)
+        self._setup(config, notifier)
+        self._status_lock = threading.Lock()
+        self.headers.update(default_headers(self._config["username"]))
+        self.mount("https://", prewarm.make_adapter(self._pool_size()))
+        if self._hosts:
+            self.mount("http://", prewarm.make_adapter(self._pool_size()))
+        # 对冲时主请求与对冲请求都在线程中发出，调用方等待先成功的一个
+        self._hedge_executor = (
+            ThreadPoolExecutor(
+                max_workers=self._pool_size() + 2,
+                thread_name_prefix=f"hedge_{self._config['username']}",
+            )
+            if self._hedging()
+            else None
+        )
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        # 对冲请求的线程池随会话关闭，不等待仍在途、已无人等待结果的对冲请求
+        executor = getattr(self, "_hedge_executor", None)
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._hedge_executor = None
+        super().close()
+
+    @property
+    def _cookie_jar(self):
+        return self.cookies
+
+    def request(self, method, url, *args, **kwargs):
+        # get / post / head 均经过这里，统一改写地址
+        return super().request(method, self._rewrite(url), *args, **kwargs)
+
     def get(self, url, *args, **kwargs):
         """重写 get 方法，验证状态码，转化为 json"""
-        res = super().get(url, *args, **kwargs)
-        res.raise_for_status()
+        with limiter.slot(url):
+            t_send = time.time()
+            with self._timer(url):
+                res = super().get(url, *args, **kwargs)
+        res.t_send, res.t_recv = t_send, time.time()
+        self._check_status_code(res)
         return res
 
     def post(self, url, *args, **kwargs):
         """重写 post 方法，验证状态码，转化为 json"""
-        res = super().post(url, *args, **kwargs)
-        res.raise_for_status()
+        with limiter.slot(url):
+            t_send = time.time()
+            with self._timer(url):
+                res = super().post(url, *args, **kwargs)
+        res.t_send, res.t_recv = t_send, time.time()
+        self._check_status_code(res)
 
         return res
 
+    def prepare(self):
+        """预热阶段构造开放时刻的 checkSqrq / saveSqxx 请求
+
+        请求体的序列化、查询参数与 headers / cookies 的合并、地址的改写与编码都在此完成，
+        开放时刻只需把字节发出去。
+        """
+        # 按当前配置展开被预约人，开放时刻直接复用
+        self._visitor_list = None
+        self._visitor_list = self._visitors()
+        prepared = {}
+        for key, (method, url, params, body) in self._prepare_targets().items():
+            request = self.prepare_request(
+                requests.Request(method, self._rewrite(url), params=params, json=body)
+            )
+            settings = self.merge_environment_settings(request.url, {}, None, None, None)
+            prepared[key] = (url, request, settings)
+        self._prepared, self._prepared_sid = prepared, self.params["sid"]
+
+    def _send_prepared(self, entry):
+        """发送预先构造的请求，验证状态码"""
+        url, request, settings = entry
+        with limiter.slot(url):
+            t_send = time.time()
+            with self._timer(url):
+                res = self.send(request, **settings)
+        res.t_send, res.t_recv = t_send, time.time()
+        self._check_status_code(res)
+        return res
+
+    def _hedged(self, phase, call, on_extra=None):
+        """开启 hedge 时对冲发送 call，否则直接调用"""
+        if self._hedge_executor is None:
+            return call()
+        return hedge.run(self._hedge_executor, phase, call, on_extra)
+
+    def warm_connections(self):
+        """解析并固定各主机地址，预先建立 TCP + TLS 连接"""
+        if not self._hosts:
+            prewarm.pin_hosts()
+        prewarm.ping(self, 1, "https://iaaa.pku.edu.cn/")
+        prewarm.ping(self, 1, "https://portal.pku.edu.cn/")
+        prewarm.ping(self, self._pool_size())
+
+    def keep_warm(self, until):
+        """在本地时刻 until 之前，定期保活连接池中到 simso 的全部连接"""
+        while True:
+            remaining = (until - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return
+            time.sleep(min(prewarm.KEEPALIVE_INTERVAL, remaining))
+            if datetime.now() >= until:
+                return
+            prewarm.ping(self, self._pool_size())
+
+    def start_keep_warm(self, until):
+        """在后台线程中保活连接直到 until"""
+        threading.Thread(
+            target=self.keep_warm,
+            args=(until,),
+            name=f"keep_warm_{self._config['username']}",
+            daemon=True,
+        ).start()
+
     def login(self) -> bool:
         """登录门户，重定向出入校申请"""
         # IAAA 登录
@@ -113,28 +544,72 @@ class Session(requests.Session):
         self.params["sid"] = sid
         self.params["_sk"] = self._config["username"]
         self.cookies.set("sid", sid, domain="simso.pku.edu.cn")
+        self.sid_issued_at = time.time()
 
         # 获取出入校申请时段信息
         return self.login_check()
 
+    def restore(self) -> bool:
+        """从会话缓存恢复 sid 与 cookies，并用 login_check 验证是否仍然有效"""
+        student_id = self._config["username"]
+        state = session_cache.load(student_id, self._config["password"])
+        if not state:
+            return False
+
+        self._import_state(state)
+        try:
+            if self.login_check():
+                logger.info(f"学生 {student_id} 复用缓存的会话")
+                return True
+        except Exception as e:
+            logger.debug(f"学生 {student_id} 缓存的会话验证失败: {e}")
+
+        self._forget_state()
+        session_cache.clear(student_id)
+        return False
+
+    def ensure_login(self, force=False) -> bool:
+        """优先复用缓存的会话，失效（或 force）时才走完整的 IAAA 登录流程"""
+        if not force and self._use_cache() and self.restore():
+            return True
+        if not self.login():
+            return False
+        if self._use_cache():
+            session_cache.save(
+                self._config["username"], self._config["password"], self._export_state()
+            )
+        return True
+
     def login_check(self):
         """检查是否已登录"""
-        json = self.get(
-            "https://simso.pku.edu.cn/ssapi/stuaffair/epiApply/getJrsqxx"
-        ).json()
-        return json["success"] and json["row"]["sfyxsq"] == "y"
+        json = self._parse(
+            self.get("https://simso.pku.edu.cn/ssapi/stuaffair/epiApply/getJrsqxx")
+        )
+        valid = json["success"] and json["row"]["sfyxsq"] == "y"
+        if not valid:
+            self.invalidate_sid()
+        return valid
+
+    def sync_clock(self, samples=5, interval=0.2):
+        """多次调用 login_check 采样服务器时钟，返回 (offset, uncertainty)"""
+        for i in range(samples):
+            if i:
+                time.sleep(interval)
+            self.login_check()
+        return self._log_clock()
 
     @wraps(login_check)
     def login_check_wrapper(func):
         def wrapper(self, *args, **kwargs):
-            if not self.login_check():
+            # TTL 内已确认 sid 有效时跳过 getJrsqxx，减少开放时刻的请求
+            if not self.sid_valid() and not self.login_check():
                 raise Exception("You should login first to use this method")
             return func(self, *args, **kwargs)
 
         return wrapper
 
     @login_check_wrapper
-    def status(self):
+    def status(self, appointment):
         """获取申请状态（当前是否可申请）"""
         """
         GET:
@@ -149,42 +624,35 @@ class Session(requests.Session):
             "timestamp": 1723230066512
         }
         """
-        json = self.get(
-            f"{self._base_url}/checkSqrq",
-            params={
-                "sid": self.params["sid"],
-                "_sk": self.params["_sk"],
-                "sqrq": self._config["yyrq"],
-            },
-        ).json()
-        assert json["success"], json["msg"]
-        return json
-
-    def save_request(self, appointment):
+        key = (appointment["mode"], appointment["yyrq"])
+        # 并发提交时只让第一个请求检查日期，其余复用其结果
+        with self._status_lock:
+            if key in self._status_cache:
+                return self._status_cache[key]
+
+            prepared = self._prepared_for("checkSqrq", *key)
+            if prepared:
+                res = self._send_prepared(prepared)
+            else:
+                res = self.get(
+                    self._url(appointment, "checkSqrq"),
+                    params={
+                        "sid": self.params["sid"],
+                        "_sk": self.params["_sk"],
+                        "sqrq": appointment["yyrq"],
+                    },
+                )
+            json = self._parse(res)
+            self._assert_success(json)
+            self._status_cache[key] = json
+            return json
+
+    def save_request(self, appointment, visitor):
         # 检查是否可申请
-        self.status()
+        self.status(appointment)
 
         """尝试保存出入校信息"""
-        """
-        {
-            "lxdh": "16666666666",
-            "yyrq": "20240101",
-            "yyxm": "东侧门",
-            "yysy": "游览",
-            "yysj": "10:00"
-            "byyrxm": "张三",
-            "byyrlxdh": "11111111111",
-            "byyrzjh": "110101200001011111",
-        }
-        """
-        template = {
-            "lxdh": self._config["phone"],
-            "yyrq": self._config["yyrq"],
-            "yyxm": self._config["yyxm"],
-            "yysj": self._config["yysj"],
-            "yysy": self._config["yysy"],
-        }
-        template.update(appointment)
+        prepared = self._prepared_for("saveSqxx", self._visitor_key(appointment, visitor))
 
         """
         POST:
@@ -199,16 +667,24 @@ class Session(requests.Session):
             "timestamp": 1704038401000
         }
         """
-        res = self.post(
-            f"{self._base_url}/saveSqxx",
-            params={"sid": self.params["sid"], "_sk": self.params["_sk"]},
-            json=template,
-        ).json()
-        assert res["success"], res["msg"]
+
+        def send():
+            if prepared:
+                return self._parse(self._send_prepared(prepared))
+            return self._parse(
+                self.post(
+                    self._url(appointment, "saveSqxx"),
+                    params={"sid": self.params["sid"], "_sk": self.params["_sk"]},
+                    json=self._build_template(appointment, visitor),
+                )
+            )
+
+        res = self._hedged("saveSqxx", send, self._reconcile(appointment, visitor))
+        self._assert_success(res)
 
         return res["row"]
 
-    def request_2fa_code(self, sqxxid):
+    def request_2fa_code(self, appointment, sqxxid):
         """
         GET:
         https://simso.pku.edu.cn/ssapi/stuaffair/epiVisitorAppt/sendEcyzCode?sid=ae14f8b3-7b29-4cd8-933e-ab92c3572f1d2110000000&_sk=2110000000&sqxxid=sqxx20240101000001
@@ -226,70 +702,125 @@ class Session(requests.Session):
           "timestamp": 1704038401001
         }
         """
-        # 获取学号特定的验证码文件路径
-        student_id = self._config["username"]
-        code_file = f"{student_id}.txt"
-
-        # 清空学号特定的验证码文件
-        with open(code_file, "w") as f:
-            f.write("")
-
-        res = self.get(
-            f"{self._base_url}/sendEcyzCode",
-            params={
-                "sid": self.params["sid"],
-                "_sk": self.params["_sk"],
-                "sqxxid": sqxxid,
-            },
-        ).json()
-        assert res["success"], res["msg"]
+        res = self._parse(
+            self.get(
+                self._url(appointment, "sendEcyzCode"),
+                params={
+                    "sid": self.params["sid"],
+                    "_sk": self.params["_sk"],
+                    "sqxxid": sqxxid,
+                },
+            )
+        )
+        self._assert_success(res)
         return
 
-    def submit_request(self, appointment) -> bool:
-        sqxxid = self.save_request(appointment)
+    def get_2fa_code(self, appointment, sqxxid):
+        """获取 sqxxid 对应的 2FA 验证码"""
+        student_id = self._config["username"]
 
         # 基于 secret 的 totp 获取
         if self._config["auto"] and self._config["totp_mode"] == "secret":
             totp = pyotp.TOTP(self._config["totp_secret"])
-            code = totp.now()
-        # 基于捷径的 totp 获取
-        elif self._config["totp_mode"] == "shortcut":
-            self.request_2fa_code(sqxxid)
-
-            # 自动获取 2FA code
-            if self._config["auto"]:
-                student_id = self._config["username"]
-                code_file = f"{student_id}.txt"
-                # 不断尝试获取学号特定的验证码文件内容，如果为空则等待 1s
-                code = ""
-                for i in range(60):  # 增加等待时间到60秒以支持多学生验证
-                    try:
-                        with open(code_file, "r") as f:
-                            code = f.read().strip()
-                        if code:
-                            break
-                    except FileNotFoundError:
-                        # 如果文件不存在，创建一个空文件
-                        with open(code_file, "w") as f:
-                            f.write("")
-
-                    if i % 10 == 0:  # 每10秒输出一次等待信息
-                        logger.info(
-                            f"Waiting for code for student {student_id}... ({i + 1}/60s)"
-                        )
-                    time.sleep(1)
-
-                # 清空验证码文件
-                with open(code_file, "w") as f:
-                    f.write("")
-
-            # 手动输入 2FA code
-            else:
-                code = input(f"Please input the 2FA code for {student_id}: ")
+            return totp.now()
+
+        if self._config["auto"] and not codes.broker.attached:
+            codes.listen(student_id)
+
+        # 流水线：登记等待者后发送验证码即释放锁，验证码按到达顺序分配
+        if self._pipelined():
+            with metrics.registry.timer("code_lock"):
+                self._code_lock.acquire()
+            try:
+                # 登记与发送在同一把锁内完成，保证登记顺序与短信发送顺序一致
+                ticket = codes.expect(student_id)
+                try:
+                    self.request_2fa_code(appointment, sqxxid)
+                except Exception:
+                    codes.cancel(student_id, ticket)
+                    raise
+            finally:
+                self._code_lock.release()
+
+            with metrics.registry.timer("code_wait"):
+                return codes.wait_for_ticket(student_id, ticket)
+
+        # 基于捷径的 totp 获取，同一学号的验证码文件只能串行使用
+        with metrics.registry.timer("code_lock"):
+            self._code_lock.acquire()
+        try:
+            # 清空学号特定的验证码文件与推送队列中的旧验证码
+            codes.reset(student_id)
+            self.request_2fa_code(appointment, sqxxid)
+
+            with metrics.registry.timer("code_wait"):
+                # 手动输入 2FA code
+                if not self._config["auto"]:
+                    return input(f"Please input the 2FA code for {student_id}: ")
+
+                # 自动获取 2FA code
+                return codes.wait_for_code(student_id)
+        finally:
+            self._code_lock.release()
+
+    def submit_request(self, appointment, visitor) -> bool:
+        key = self._visitor_key(appointment, visitor)
+        name = self._label(appointment, visitor)
+        try:
+            with metrics.labels(
+                student=self._config["username"], date=appointment["yyrq"], visitor=name
+            ), metrics.registry.timer("visitor_total"):
+                self._submit_request(appointment, visitor, key, name)
+        except Exception as e:
+            if self.journal:
+                self.journal.finished(key, name, False, str(e))
+            raise
+        if self.journal:
+            self.journal.finished(key, name, True)
+
+    def _submit_request(self, appointment, visitor, key, name):
+        # 崩溃前已保存但未提交的申请直接复用 sqxxid
+        sqxxid = self.journal.sqxxid(key) if self.journal else None
+        if sqxxid:
+            logger.info(f"复用 {name} 此前保存的申请 {sqxxid}")
+        else:
+            with self._slot():
+                if self.retry:
+                    sqxxid = self.retry.call(
+                        "saveSqxx",
+                        self.save_request,
+                        appointment,
+                        visitor,
+                        on_ambiguous=self._reconcile_retry(appointment, visitor),
+                    )
+                else:
+                    sqxxid = self.save_request(appointment, visitor)
+        if self.journal:
+            self.journal.saved(key, name, sqxxid)
+        code = self.get_2fa_code(appointment, sqxxid)
 
         code = re.search(r"\d{6}", code).group()
         assert code, f"{'[Error]':<15}: Invalid 2FA code"
 
+        tried = set()
+        while True:
+            tried.add(code)
+            try:
+                self._assert_success(self._submit_code(appointment, sqxxid, code))
+                break
+            except SimsoError as e:
+                if not self._code_rejected(e):
+                    raise
+                # 流水线下验证码按到达顺序分配，前面的短信迟到或丢失时会错位，改用其它验证码
+                code = codes.wait_for_other(self._config["username"], tried)
+                logger.warning(f"{name} 的验证码被判错误，改用验证码 {code} 重试")
+        if self._pipelined():
+            codes.confirm(self._config["username"], code)
+        logger.success(f"Succeed: {name}")
+        if self._notifier:
+            self._notifier.send(f"Succeed: {name}")
+
+    def _submit_code(self, appointment, sqxxid, code):
         """
         GET:
         https://simso.pku.edu.cn/ssapi/stuaffair/epiVisitorAppt/submitSqxx?sid=ae14f8b3-7b29-4cd8-933e-ab92c3572f1d2110000000&_sk=2110000000&sqxxid=sqxx20240101000001&code=123456
@@ -303,50 +834,153 @@ class Session(requests.Session):
             "timestamp": 1704038401002
         }
         """
-        res = self.get(
-            f"{self._base_url}/submitSqxx",
-            params={
-                "sid": self.params["sid"],
-                "_sk": self.params["_sk"],
-                "sqxxid": sqxxid,
-                "code": code,
-            },
-        ).json()
-        assert res["success"], res["msg"]
-        logger.success(f"Succeed: {appointment['byyrxm']}")
-        if self._notifier:
-            self._notifier.send(f"Succeed: {appointment['byyrxm']}")
-        return
+        # 对冲提交使用同一个 sqxxid 与验证码，服务端只会受理一次
+        with self._slot():
+            return self._hedged(
+                "submitSqxx",
+                lambda: self._parse(
+                    self.get(
+                        self._url(appointment, "submitSqxx"),
+                        params={
+                            "sid": self.params["sid"],
+                            "_sk": self.params["_sk"],
+                            "sqxxid": sqxxid,
+                            "code": code,
+                        },
+                    )
+                ),
+            )
 
     def submit_all(self):
-        """提交所有申请"""
-        # 兼容新旧配置格式 - appointments是新格式传入的visitors数组
-        appointments = self._config.get("appointments", [])
-
-        for appointment in appointments:
-            converted_data = {
-                "byyrxm": appointment["name"],
-                "byyrzjh": appointment["id"],
-                "byyrlxdh": appointment["phone"],
+        """提交所有申请，返回每位被预约人的结果"""
+        results, visitors = self._split_succeeded(self._visitors())
+        self._reset_status()
+
+        concurrency = self._config.get("concurrency", 1)
+        # 流水线：每位被预约人一个线程，等待验证码不占名额，保存与提交最多 concurrency 个同时进行
+        if self._pipelined() and len(visitors) > 1:
+            return results + self._submit_concurrently(
+                visitors, len(visitors), slots=concurrency
+            )
+        if concurrency > 1 and len(visitors) > 1:
+            return results + self._submit_concurrently(visitors, concurrency)
+
+        # 串行提交，任一失败即抛出异常
+        for appointment, visitor in visitors:
+            self.submit_request(appointment, visitor)
+            results.append((self._label(appointment, visitor), True, "success"))
+        return results
+
+    def _submit_concurrently(self, visitors, concurrency, slots=None):
+        """在同一个 sid 上并发执行各被预约人的 save / submit 流程"""
+        results = [None] * len(visitors)
+        self._slots = threading.BoundedSemaphore(slots) if slots else None
+        with ThreadPoolExecutor(
+            max_workers=min(concurrency, len(visitors)),
+            thread_name_prefix=f"submit_{self._config['username']}",
+        ) as executor:
+            futures = {
+                executor.submit(self.submit_request, *pair): i
+                for i, pair in enumerate(visitors)
             }
-            self.submit_request(converted_data)
+            for future in as_completed(futures):
+                i = futures[future]
+                name = self._label(*visitors[i])
+                try:
+                    future.result()
+                    results[i] = (name, True, "success")
+                except Exception as e:
+                    logger.error(f"Failed: {name} - {e}")
+                    results[i] = (name, False, str(e))
+        self._slots = None
+
+        # 部分失败时同样返回每位被预约人的结果，由调用方展示并记录
+        return results
 
 
 class BarkNotifier:
+    """Bark 推送：send 只将消息放入后台队列，不阻塞提交流程
+
+    所有通知器共用一个后台线程与一个 HTTP 连接；短时间内同一 key 的多条消息
+    （每位被预约人的 Succeed 与最后的汇总）合并为一条推送，退出时发送剩余消息。
+    """
+
+    _queue = queue.Queue()
+    _worker = None
+    _worker_lock = threading.Lock()
+    _flushing = threading.Event()
+
     def __init__(self, token):
         self._token = token
         self.valid = True if token else False
 
     def send(self, body):
         if self._token:
-            requests.post(
-                f"https://api.day.app/{self._token}",
+            self._ensure_worker()
+            self._queue.put((self._token, body))
+        else:
+            print(f"Notification: {body}")
+
+    @classmethod
+    def _ensure_worker(cls):
+        with cls._worker_lock:
+            if cls._worker is None:
+                cls._worker = threading.Thread(target=cls._run, name="bark", daemon=True)
+                cls._worker.start()
+                atexit.register(cls.flush)
+
+    @classmethod
+    def _run(cls):
+        http = requests.Session()
+        while True:
+            batch = [cls._queue.get()]
+            # 等待窗口内的后续消息，退出前的 flush 不再等待
+            deadline = time.monotonic() + BARK_COALESCE_WINDOW
+            while not cls._flushing.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(cls._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            while True:
+                try:
+                    batch.append(cls._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            bodies = {}
+            for token, body in batch:
+                bodies.setdefault(token, []).append(body)
+            for token, lines in bodies.items():
+                cls._post(http, token, "\n".join(lines))
+            for _ in batch:
+                cls._queue.task_done()
+
+    @staticmethod
+    def _post(http, token, body):
+        try:
+            http.post(
+                f"https://api.day.app/{token}",
                 data={
                     "title": "PKU-Auto-Reservation",
                     "body": body,
                     "icon": "https://cdn.arthals.ink/pku.jpg",
                     "level": "timeSensitive",
                 },
+                timeout=BARK_TIMEOUT,
             )
-        else:
-            print(f"Notification: {body}")
+        except requests.RequestException as e:
+            logger.warning(f"Bark 推送失败: {e}")
+
+    @classmethod
+    def flush(cls, timeout=BARK_TIMEOUT * 2):
+        """发送队列中剩余的消息，最多等待 timeout 秒"""
+        if cls._worker is None:
+            return
+        cls._flushing.set()
+        deadline = time.monotonic() + timeout
+        while cls._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        cls._flushing.clear()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   session_cache.py
+# @Time    :   2025/08/24 09:41:27
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import base64
+import json
+import os
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from loguru import logger
+
+# 会话缓存目录，每个学号一个文件
+CACHE_DIR = os.environ.get("PKU_SESSION_CACHE_DIR", ".session_cache")
+# 由 IAAA 密码派生加密密钥的迭代次数
+KDF_ITERATIONS = 200_000
+SALT_SIZE = 16
+
+# 进程内缓存，同一进程中的会话直接复用，无需解密磁盘文件
+_memory = {}
+_lock = threading.Lock()
+
+
+def _path(student_id):
+    return os.path.join(CACHE_DIR, f"{student_id}.bin")
+
+
+def _fernet(password, salt):
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS
+    )
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(str(password).encode())))
+
+
+def save(student_id, password, state):
+    """保存会话状态（sid、_sk、cookies），磁盘文件以 IAAA 密码派生的密钥加密"""
+    state = dict(state, saved_at=time.time())
+    with _lock:
+        _memory[str(student_id)] = state
+
+    salt = os.urandom(SALT_SIZE)
+    token = _fernet(password, salt).encrypt(json.dumps(state).encode())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{_path(student_id)}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(salt + token)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, _path(student_id))
+    except OSError as e:
+        logger.warning(f"写入会话缓存失败: {e}")
+
+
+def load(student_id, password):
+    """读取会话状态，不存在或无法解密时返回 None"""
+    with _lock:
+        state = _memory.get(str(student_id))
+    if state:
+        return state
+
+    try:
+        with open(_path(student_id), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        salt, token = data[:SALT_SIZE], data[SALT_SIZE:]
+        state = json.loads(_fernet(password, salt).decrypt(token))
+    except (InvalidToken, ValueError):
+        logger.warning(f"学生 {student_id} 的会话缓存无法解密，已忽略")
+        return None
+
+    with _lock:
+        _memory[str(student_id)] = state
+    return state
+
+
+def clear(student_id):
+    """删除失效的会话缓存"""
+    with _lock:
+        _memory.pop(str(student_id), None)
+    try:
+        os.remove(_path(student_id))
+    except OSError:
+        pass
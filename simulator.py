@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   simulator.py
+# @Time    :   2025/08/26 09:31:48
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib import parse
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, RedirectResponse
+from loguru import logger
+
+import codes
+
+# 本地模拟 iaaa / portal / simso 三个主机的预约相关接口，用于离线演练与压测。
+# 三个主机共用一个端口，客户端通过配置 hosts 将真实地址改写到这里。
+
+DEFAULT_PORT = 8600
+
+# 模拟器行为，可在启动前修改，或通过命令行参数设置
+settings = {
+    # 每个接口的基础延迟与随机抖动（秒）
+    "latency": 0.03,
+    "jitter": 0.02,
+    # 各接口变慢的概率与额外延迟（秒），模拟高峰时的长尾
+    "slow_rates": {"saveSqxx": 0.0, "submitSqxx": 0.0},
+    "slow_latency": 1.0,
+    # 各接口返回 HTTP 503 的概率，未列出的接口不注入错误
+    "error_rates": {"checkSqrq": 0.0, "saveSqxx": 0.0},
+    # 每个 (mode, 预约日期) 可提交成功的名额，None 为不限
+    "quota": None,
+    # 开放时刻（本地时间），之前 checkSqrq / saveSqxx 返回"预约尚未开放"，None 为始终开放
+    "open_time": None,
+    # sendEcyzCode 之后多久推送验证码（秒），模拟短信到达
+    "code_delay": 0.5,
+    # sid 自签发起的有效期（秒），None 为永不过期
+    "sid_lifetime": None,
+}
+
+app = FastAPI()
+
+
+class SimState:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # token / sid -> 学号
+        self.tokens = {}
+        self.sids = {}
+        # sid -> 签发时刻
+        self.issued = {}
+        # sqxxid -> {student, mode, yyrq, name, code, submitted}
+        self.sqxx = {}
+        # (mode, yyrq) -> 已提交成功的数量
+        self.used = {}
+        # (接口, 学号, 被预约人, 本地时刻, 是否成功)
+        self.events = []
+
+    def record(self, endpoint, student, name, success):
+        with self.lock:
+            self.events.append((endpoint, student, name, time.time(), success))
+
+
+state = SimState()
+
+
+def reset():
+    """清空模拟器状态，供多轮压测复用"""
+    global state
+    state = SimState()
+
+
+def _json(success=True, row=None, msg="成功"):
+    return {
+        "code": 1 if success else 0,
+        "row": row,
+        "success": success,
+        "msg": msg,
+        "timestamp": int(time.time() * 1000),
+    }
+
+
+async def _delay(endpoint):
+    """注入延迟与错误，返回需要直接返回的 503 响应或 None"""
+    latency = settings["latency"] + random.uniform(-1, 1) * settings["jitter"]
+    if random.random() < settings["slow_rates"].get(endpoint, 0):
+        latency += settings["slow_latency"]
+    await asyncio.sleep(max(latency, 0))
+    if random.random() < settings["error_rates"].get(endpoint, 0):
+        return Response(status_code=503)
+    return None
+
+
+def _student(request):
+    sid = request.query_params.get("sid")
+    lifetime = settings["sid_lifetime"]
+    if lifetime is not None and time.time() - state.issued.get(sid, 0) > lifetime:
+        return None
+    return state.sids.get(sid)
+
+
+def _opened():
+    return settings["open_time"] is None or datetime.now() >= settings["open_time"]
+
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def index():
+    # 保活请求 HEAD 的静态页面
+    return HTMLResponse("<html></html>")
+
+
+@app.post("/iaaa/oauthlogin.do")
+async def oauthlogin(request: Request):
+    await _delay("oauthlogin")
+    # 表单体自行解析，无需依赖 python-multipart
+    form = parse.parse_qs((await request.body()).decode())
+    token = uuid.uuid4().hex
+    state.tokens[token] = form.get("userName", [""])[0]
+    return _json() | {"token": token}
+
+
+@app.get("/portal2017/ssoLogin.do")
+async def sso_login(request: Request):
+    await _delay("ssoLogin")
+    # 门户以 cookie 记住登录用户
+    response = HTMLResponse("<html></html>")
+    response.set_cookie("portal_user", state.tokens.get(request.query_params.get("token"), ""))
+    return response
+
+
+@app.get("/portal2017/util/appSysRedir.do")
+async def app_sys_redir(request: Request):
+    await _delay("appSysRedir")
+    student = request.cookies.get("portal_user")
+    if not student:
+        return Response(status_code=403)
+    token = uuid.uuid4().hex
+    state.tokens[token] = student
+    # 以相对地址重定向，客户端停留在模拟器上
+    return RedirectResponse(f"/pages/sadEpiVisitorAppt.html?token={token}", 302)
+
+
+@app.get("/pages/sadEpiVisitorAppt.html")
+async def visitor_page():
+    return HTMLResponse("<html></html>")
+
+
+@app.get("/ssapi/simsoLogin")
+async def simso_login(request: Request):
+    await _delay("simsoLogin")
+    token = request.query_params.get("token")
+    if token not in state.tokens:
+        return _json(False, msg="token 无效")
+    student = state.tokens[token]
+    sid = f"{uuid.uuid4()}{student}"
+    state.sids[sid] = student
+    state.issued[sid] = time.time()
+    return _json() | {"sid": sid}
+
+
+@app.get("/ssapi/stuaffair/epiApply/getJrsqxx")
+async def get_jrsqxx(request: Request):
+    await _delay("getJrsqxx")
+    if not _student(request):
+        return _json(False, msg="未登录或登录超时")
+    return _json(row={"sfyxsq": "y"})
+
+
+@app.get("/ssapi/{prefix:path}/checkSqrq")
+async def check_sqrq(request: Request, prefix: str):
+    error = await _delay("checkSqrq")
+    if error:
+        return error
+    if not _student(request):
+        return _json(False, msg="未登录或登录超时")
+    if not _opened():
+        return _json(False, msg="预约尚未开放")
+    return _json()
+
+
+@app.post("/ssapi/{prefix:path}/saveSqxx")
+async def save_sqxx(request: Request, prefix: str):
+    error = await _delay("saveSqxx")
+    if error:
+        return error
+    student = _student(request)
+    if not student:
+        return _json(False, msg="未登录或登录超时")
+    body = await request.json()
+    name = body.get("byyrxm")
+    if not _opened():
+        state.record("saveSqxx", student, name, False)
+        return _json(False, msg="预约尚未开放")
+
+    key = (prefix, str(body.get("yyrq")))
+    with state.lock:
+        if settings["quota"] is not None and state.used.get(key, 0) >= settings["quota"]:
+            full = True
+        else:
+            full = False
+            sqxxid = f"sqxx{body.get('yyrq')}{len(state.sqxx) + 1:06d}"
+            state.sqxx[sqxxid] = {
+                "student": student,
+                "key": key,
+                "name": name,
+                "code": None,
+                "submitted": False,
+            }
+    state.record("saveSqxx", student, name, not full)
+    if full:
+        return _json(False, msg="当日名额已满")
+    return _json(row=sqxxid, msg="success")
+
+
+@app.get("/ssapi/{prefix:path}/sendEcyzCode")
+async def send_ecyz_code(request: Request, prefix: str):
+    error = await _delay("sendEcyzCode")
+    if error:
+        return error
+    student = _student(request)
+    record = state.sqxx.get(request.query_params.get("sqxxid"))
+    if not student or not record:
+        return _json(False, msg="申请不存在")
+
+    code = f"{random.randint(0, 999999):06d}"
+    record["code"] = code
+    # 模拟短信到达后由快捷指令推送验证码
+    asyncio.get_running_loop().call_later(
+        settings["code_delay"], codes.push, student, code
+    )
+    return _json(row={"flag": True, "errmsg": "", "type": "opt"}, msg="操作成功！")
+
+
+@app.get("/ssapi/{prefix:path}/submitSqxx")
+async def submit_sqxx(request: Request, prefix: str):
+    error = await _delay("submitSqxx")
+    if error:
+        return error
+    student = _student(request)
+    sqxxid = request.query_params.get("sqxxid")
+    record = state.sqxx.get(sqxxid)
+    if not student or not record:
+        return _json(False, msg="申请不存在")
+    if record["code"] != request.query_params.get("code"):
+        state.record("submitSqxx", student, record["name"], False)
+        return _json(False, msg="验证码错误")
+
+    with state.lock:
+        if record["submitted"]:
+            full, duplicate = False, True
+        elif (
+            settings["quota"] is not None
+            and state.used.get(record["key"], 0) >= settings["quota"]
+        ):
+            full, duplicate = True, False
+        else:
+            full, duplicate = False, False
+            record["submitted"] = True
+            state.used[record["key"]] = state.used.get(record["key"], 0) + 1
+    state.record("submitSqxx", student, record["name"], not (full or duplicate))
+    if duplicate:
+        return _json(False, msg="请勿重复提交")
+    if full:
+        return _json(False, msg="当日名额已满")
+    return _json(row=sqxxid, msg="success")
+
+
+def start(port=DEFAULT_PORT, host="127.0.0.1"):
+    """在后台线程中启动模拟器，返回其地址"""
+    import uvicorn
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=host, port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, name="simulator", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"模拟器启动失败，请检查端口 {port}")
+        time.sleep(0.01)
+    return f"http://{host}:{port}"
+
+
+def host_overrides(origin):
+    """将三个真实主机改写到模拟器的 hosts 配置"""
+    return {
+        f"https://{host}": origin
+        for host in ("iaaa.pku.edu.cn", "portal.pku.edu.cn", "simso.pku.edu.cn")
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="接口基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="延迟随机抖动（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="saveSqxx / submitSqxx 变慢的概率")
+    parser.add_argument("--slow-latency", type=float, default=settings["slow_latency"], help="慢请求的额外延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="checkSqrq / saveSqxx 返回 503 的概率")
+    parser.add_argument("--quota", type=int, default=None, help="每个日期可提交成功的名额")
+    parser.add_argument("--code-delay", type=float, default=settings["code_delay"], help="验证码推送延迟（秒）")
+    parser.add_argument("--sid-lifetime", type=float, default=None, help="sid 有效期（秒），默认永不过期")
+
+
+def apply_arguments(args, open_time=None):
+    settings["latency"] = args.latency
+    settings["jitter"] = args.jitter
+    settings["slow_rates"] = {"saveSqxx": args.slow_rate, "submitSqxx": args.slow_rate}
+    settings["slow_latency"] = args.slow_latency
+    settings["error_rates"] = {"checkSqrq": args.error_rate, "saveSqxx": args.error_rate}
+    settings["quota"] = args.quota
+    settings["code_delay"] = args.code_delay
+    settings["sid_lifetime"] = args.sid_lifetime
+    settings["open_time"] = open_time
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="PKU 预约接口本地模拟器")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--open-in", type=float, default=None, help="多少秒后开放预约，默认始终开放")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    open_time = (
+        datetime.now() + timedelta(seconds=args.open_in) if args.open_in is not None else None
+    )
+    apply_arguments(args, open_time)
+    logger.info(f"模拟器设置: {settings}")
+    logger.info(f"在配置中设置 hosts 即可指向模拟器: {host_overrides(f'http://127.0.0.1:{args.port}')}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# @Author  :   Arthals
+# @File    :   watcher.py
+# @Time    :   2025/08/30 15:48:19
+# @Contact :   zhuozhiyongde@126.com
+# @Software:   Visual Studio Code
+
+
+import os
+import threading
+
+from loguru import logger
+
+# 检查配置文件修改时间的间隔（秒）
+POLL_INTERVAL = 1.0
+# 检测到修改后，文件保持不变多久才重新加载（秒），避免读到编辑器写到一半的文件
+SETTLE_DELAY = 0.2
+
+
+class ConfigWatcher:
+    """轮询配置文件的修改时间与大小，变化后在后台线程中调用 callback(path)"""
+
+    def __init__(self, path, callback, interval=POLL_INTERVAL) -> None:
+        self.path = path
+        self._callback = callback
+        self._interval = interval
+        self._stop = threading.Event()
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        threading.Thread(target=self._run, name="config_watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            # 等文件写完
+            while not self._stop.wait(SETTLE_DELAY):
+                settled = self._stat()
+                if settled == signature:
+                    break
+                signature = settled
+            self._signature = signature
+            try:
+                self._callback(self.path)
+            except Exception as e:
+                logger.error(f"重新加载 {self.path} 失败，保持当前调度: {e}")
+
+
+def watch(path, callback, interval=POLL_INTERVAL):
+    """开始监视配置文件"""
+    return ConfigWatcher(path, callback, interval).start()